@@ -0,0 +1,229 @@
+"""
+_csi_common.py — helpers shared by csi.py, complete_csi.py, csi_metadata.py
+and csi_inspector.py
+
+File picker, MAC / timestamp parsing, the one-pass frame → flat-array
+transform and the (optionally numba-compiled) matrix reductions. Keeping a
+single copy means one parse at import time and one numba cache for all
+entry points.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange  # optional: fused matrix reductions
+except ImportError:
+    njit = None
+
+
+# -------------------------------------------------------------
+#                   FILE PICKER
+# -------------------------------------------------------------
+def pick_file():
+    import tkinter as tk
+    from tkinter import filedialog
+
+    root = tk.Tk()
+    root.withdraw()
+    root.update()
+    path = filedialog.askopenfilename(
+        title="Select PicoScenes .csi file",
+        filetypes=[("PicoScenes CSI", "*.csi"), ("All files", "*.*")]
+    )
+    root.destroy()
+    if not path:
+        raise SystemExit("No file selected.")
+    return path
+
+
+# -------------------------------------------------------------
+#                   MAC PARSER
+# -------------------------------------------------------------
+MAC_BROADCAST_KEY = 0xFFFFFFFFFFFF
+
+
+def macs_to_u64(addrs):
+    """
+    (..., 6) uint8 addresses → (...) uint64 keys (6 little-endian bytes +
+    2 zero pad, the layout to_soa builds in place).
+    """
+    addrs = np.asarray(addrs, dtype=np.uint8)
+    padded = np.zeros(addrs.shape[:-1] + (8,), dtype=np.uint8)
+    padded[..., :6] = addrs
+    return padded.view("<u8")[..., 0]
+
+
+def u64_to_mac(key):
+    """
+    Inverse of the packed uint64 MAC key (6 little-endian bytes + 2 zero pad).
+    """
+    return int(key).to_bytes(8, "little")[:6].hex(":").upper()
+
+
+# -------------------------------------------------------------
+#                   TIMESTAMP EXTRACTOR
+# -------------------------------------------------------------
+def get_timestamp(rx_basic):
+    """
+    Return one timestamp in microseconds from RxSBasic dict.
+    Tries several key spellings (Timestamp/SystemTime).
+    """
+    if not isinstance(rx_basic, dict):
+        return None
+
+    for key in ("Timestamp", "timestamp", "SystemTime", "systemTime"):
+        if key in rx_basic:
+            v = rx_basic[key]
+            if np.isscalar(v):
+                return int(v)
+            arr = np.asarray(v).ravel()  # no copy when v is already an array
+            if arr.size:
+                return int(arr[0])
+    return None
+
+
+def resolve_header_keys(frames):
+    """
+    Key spellings (StandardHeader/standardHeader, Addr1/addr1, ...) used by
+    this file, taken from the first frame that carries a header.
+    """
+    for f in frames:
+        for k_sh in ("StandardHeader", "standardHeader"):
+            sh = f.get(k_sh)
+            if isinstance(sh, dict):
+                return (k_sh,) + tuple(
+                    f"Addr{n}" if f"Addr{n}" in sh else f"addr{n}" for n in (1, 2, 3)
+                )
+    return "StandardHeader", "Addr1", "Addr2", "Addr3"
+
+
+def resolve_rx_keys(frames):
+    """
+    Key spellings (RxSBasic/rxSBasic, Timestamp/SystemTime/...) used by this
+    file, taken from the first frame that carries an RxSBasic block.
+    """
+    for f in frames:
+        for k_rb in ("RxSBasic", "rxSBasic"):
+            rb = f.get(k_rb)
+            if isinstance(rb, dict):
+                k_ts = next((k for k in ("Timestamp", "timestamp", "SystemTime", "systemTime")
+                             if k in rb), "Timestamp")
+                return k_rb, k_ts
+    return "RxSBasic", "Timestamp"
+
+
+def to_soa(frames):
+    """
+    One pass over the frame dicts (array-of-structures) into flat arrays:
+
+        addr_keys  : (F, 3) uint64  Addr1/2/3 packed as 6 LE bytes + 2 zero pad
+        addr_valid : (F, 3) bool    address present, non-zero, non-broadcast
+        has_csi    : (F,)   bool    frame carries a CSI block
+        ts_us      : (T,)   int64   timestamps of the CSI frames (µs)
+        csi_blocks : list of the CSI sub-dicts, in frame order
+
+    Everything downstream works on these instead of walking `frames` again.
+    """
+    F = len(frames)
+    addrs = np.zeros((F, 3, 8), dtype=np.uint8)
+    present = np.zeros((F, 3), dtype=bool)
+    has_csi = np.zeros(F, dtype=bool)
+    ts_us = np.empty(F, dtype=np.int64)
+    num_ts = 0
+    csi_blocks = []
+
+    # A file uses one key spelling throughout; resolve it once instead of
+    # probing both capitalizations on every frame.
+    K_SH, K_A1, K_A2, K_A3 = resolve_header_keys(frames)
+    K_RB, K_TS = resolve_rx_keys(frames)
+
+    for i, f in enumerate(frames):
+        sh = f.get(K_SH)
+        if isinstance(sh, dict):
+            # Addr1 = receiver, Addr2 = transmitter, Addr3 = BSSID / routing
+            for j, key in enumerate((K_A1, K_A2, K_A3)):
+                addr = sh.get(key)
+                if addr is None:
+                    continue
+                try:
+                    arr = np.asarray(addr, dtype=np.uint8).ravel()
+                except Exception:
+                    continue
+                if arr.size >= 6:
+                    addrs[i, j, :6] = arr[:6]
+                    present[i, j] = True
+
+        c = f.get("CSI")
+        if isinstance(c, dict):
+            has_csi[i] = True
+            csi_blocks.append(c)
+            try:
+                ts_us[num_ts] = f[K_RB][K_TS][0]
+                num_ts += 1
+            except Exception:
+                t = get_timestamp(f.get("RxSBasic") or f.get("rxSBasic"))
+                if t is not None:
+                    ts_us[num_ts] = t
+                    num_ts += 1
+
+    addr_keys = addrs.view("<u8")[..., 0]
+    return {
+        "addr_keys": addr_keys,
+        "addr_valid": present & (addr_keys != 0) & (addr_keys != MAC_BROADCAST_KEY),
+        "has_csi": has_csi,
+        "ts_us": ts_us[:num_ts],
+        "csi_blocks": csi_blocks,
+    }
+
+
+# -------------------------------------------------------------
+#                   SUBCARRIER INDEX
+# -------------------------------------------------------------
+def subcarrier_index(raw):
+    """
+    SubcarrierIndex as a 1-D int64 array (empty if missing). The usual
+    inputs -- an int64 ndarray or a flat list of Python ints -- skip the
+    generic asarray + astype copy.
+    """
+    if raw is None:
+        return np.empty(0, dtype=np.int64)
+    if isinstance(raw, np.ndarray) and raw.dtype == np.int64:
+        return raw.ravel()
+    if isinstance(raw, list) and (not raw or type(raw[0]) is int):
+        try:
+            return np.fromiter(raw, dtype=np.int64, count=len(raw))
+        except (TypeError, ValueError):
+            pass
+    return np.asarray(raw).astype(np.int64, copy=False).ravel()
+
+
+# -------------------------------------------------------------
+#                   MATRIX REDUCTIONS
+# -------------------------------------------------------------
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _row_col_means_jit(M):
+        n, k = M.shape
+        nchunks = min(n, 64)
+        row = np.empty(n)
+        part = np.zeros((nchunks, k))
+        for c in prange(nchunks):
+            for i in range(c * n // nchunks, (c + 1) * n // nchunks):
+                s = 0.0
+                for j in range(k):
+                    x = M[i, j]
+                    s += x
+                    part[c, j] += x
+                row[i] = s / k
+        return row, part.sum(axis=0) / n
+
+
+def row_col_means(M):
+    """
+    Per-frame (row) and per-subcarrier (column) means of an (N, K) matrix.
+    With numba both come out of one pass over M (row chunks in parallel,
+    per-chunk column partials); otherwise two NumPy reductions.
+    """
+    if njit is not None:
+        return _row_col_means_jit(np.ascontiguousarray(M))
+    return M.mean(axis=1), M.mean(axis=0)
@@ -7,9 +7,11 @@ Author: Obak Bismoy
 
 import os
 import sys
+import math
 import time
 import shutil
 import subprocess
+from collections import Counter, defaultdict
 from datetime import datetime
 import tkinter as tk
 from tkinter import ttk, messagebox
@@ -37,84 +39,158 @@ ADAPTERS = ["wlxb01921e7721f", "wlx00c0cab88d1f"]
 # ---------- Utility ----------
 def now_tag(): return datetime.now().strftime("%Y%m%d_%H%M%S")
 
-def run(cmd, *, capture=False, soft=False):
-    print(f"[RUN] {cmd}")
-    res = subprocess.run(cmd, shell=True, capture_output=capture, text=capture)
+def run(argv, *, capture=False, soft=False):
+    # argv list, no shell: nothing to quote, no /bin/sh fork per command
+    shown=" ".join(argv)
+    print(f"[RUN] {shown}")
+    res = subprocess.run(argv, capture_output=capture, text=capture)
     if not soft and res.returncode != 0:
         err = (res.stderr or "").strip() if capture else ""
-        print(f"[ERROR] {cmd}\n{err}")
+        print(f"[ERROR] {shown}\n{err}")
         sys.exit(1)
     return (res.stdout.strip() if capture else None)
 
 def ensure_dir(path): os.makedirs(path, exist_ok=True)
+def fsync_file(path):
+    # flush only the capture file, not every dirty page on the host
+    try:
+        fd=os.open(path,os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError:
+        os.sync(); time.sleep(0.5)
+
 def file_size_ok(path): return os.path.exists(path) and os.path.getsize(path) > 64
 
 # ---------- Network ----------
 def set_monitor(iface, freq, center1):
-    run(f"sudo nmcli dev set {iface} managed no", soft=True)
-    run(f"sudo ip link set {iface} down")
-    run(f"sudo iw dev {iface} set type monitor")
-    run(f"sudo ip link set {iface} up")
-    run(f"sudo iw dev {iface} set freq {freq} 80 {center1}")
-    info = run(f"iw dev {iface} info", capture=True, soft=True)
+    run(["sudo","nmcli","dev","set",iface,"managed","no"], soft=True)
+    run(["sudo","ip","link","set",iface,"down"])
+    run(["sudo","iw","dev",iface,"set","type","monitor"])
+    run(["sudo","ip","link","set",iface,"up"])
+    run(["sudo","iw","dev",iface,"set","freq",str(freq),"80",str(center1)])
+    info = run(["iw","dev",iface,"info"], capture=True, soft=True)
     print(info)
 
 def restore_managed(iface):
     print("[CLEANUP] Restoring interface & NetworkManager...")
-    run(f"sudo ip link set {iface} down", soft=True)
-    run(f"sudo iw dev {iface} set type managed", soft=True)
-    run(f"sudo ip link set {iface} up", soft=True)
-    run(f"sudo nmcli dev set {iface} managed yes", soft=True)
+    run(["sudo","ip","link","set",iface,"down"], soft=True)
+    run(["sudo","iw","dev",iface,"set","type","managed"], soft=True)
+    run(["sudo","ip","link","set",iface,"up"], soft=True)
+    run(["sudo","nmcli","dev","set",iface,"managed","yes"], soft=True)
 
 def nmcli_connect(ssid, sta_iface, pwd):
-    run(f"sudo nmcli dev set {sta_iface} managed yes", soft=True)
-    run(f"sudo nmcli dev disconnect {sta_iface}", soft=True)
-    run(f'sudo nmcli dev wifi connect "{ssid}" password "{pwd}" ifname "{sta_iface}"', soft=True)
+    run(["sudo","nmcli","dev","set",sta_iface,"managed","yes"], soft=True)
+    run(["sudo","nmcli","dev","disconnect",sta_iface], soft=True)
+    run(["sudo","nmcli","dev","wifi","connect",ssid,"password",pwd,"ifname",sta_iface], soft=True)
 
 def start_iperf3(ip, port, secs, par):
     if not shutil.which("iperf3"):
         print("[IPERF] iperf3 not found; skipping.")
         return None
-    cmd=f"iperf3 -c {ip} -p {port} -t {secs} -P {par}"
+    cmd=["iperf3","-c",ip,"-p",str(port),"-t",str(secs),"-P",str(par)]
     try:
-        p=subprocess.Popen(cmd.split(),stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+        p=subprocess.Popen(cmd,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
         print(f"[IPERF] Started iperf3 client -> {ip}:{port} for {secs}s ({par} streams)")
         return p
     except Exception as e:
         print(f"[IPERF] Error: {e}")
         return None
 
+# ---------- Capture ----------
+# BPF capture filters, tightest first. Compressed beamforming reports are
+# VHT action frames: mgmt action / action-no-ack (fc 0xd0 / 0xe0) whose
+# first body byte (category, after the 24-byte header) is VHT = 21 (0x15).
+# Older libpcap builds may reject the wlan[] byte match; fall back to the
+# action-frame-only filter, then to no filter at all.
+CAPTURE_FILTERS = [
+    "(wlan[0] == 0xd0 or wlan[0] == 0xe0) and wlan[24:1] == 0x15",
+    "wlan[0] == 0xd0 or wlan[0] == 0xe0",
+    None,
+]
+
+def capture_cmd(iface, tmp, bpf):
+    secs=str(DEFAULTS["CAPTURE_TIME"])
+    if shutil.which("dumpcap"):
+        # Wireshark's capture engine; stops itself after the duration
+        cmd=["sudo","dumpcap","-q","-i",iface,"-s","0","-a","duration:"+secs,"-w",tmp]
+        if bpf: cmd+=["-f",bpf]
+    else:
+        cmd=["sudo","tcpdump","-i",iface,"-s","0","-U","-G",secs,"-W","1","-w",tmp]
+        if bpf: cmd.append(bpf)
+    return cmd
+
+def start_capture(iface, tmp):
+    for bpf in CAPTURE_FILTERS:
+        cmd=capture_cmd(iface,tmp,bpf)
+        proc=subprocess.Popen(cmd,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+        try: proc.wait(timeout=1.0)
+        except subprocess.TimeoutExpired:
+            print(f"[CAPTURE] {cmd[1]} filter: {bpf or '(none)'}")
+            return proc
+        print(f"[CAPTURE] {cmd[1]} rejected filter '{bpf}', retrying...")
+    sys.exit(f"{cmd[1]} failed to start.")
+
 # ---------- tshark analysis ----------
-def tshark_count_bfi(pcap):
-    out=run(f'tshark -r "{pcap}" -Y "wlan.vht.compressed_beamforming_report" | wc -l',capture=True,soft=True)
-    return int(out.strip() or 0)
-
-def detect_ap_mac(pcap):
-    out=run(f'tshark -r "{pcap}" -Y "wlan.vht.compressed_beamforming_report" -T fields -e wlan.da',capture=True,soft=True)
-    counts={}
-    for line in out.splitlines():
-        mac=line.strip()
-        if mac: counts[mac]=counts.get(mac,0)+1
-    if not counts: return None,{}
-    ap=max(counts.items(),key=lambda kv:kv[1])[0]
-    return ap,counts
-
-def list_rx_counts(pcap,ap):
-    out=run(f'tshark -r "{pcap}" -Y "wlan.vht.compressed_beamforming_report && wlan.da=={ap}" -T fields -e wlan.sa',capture=True,soft=True)
-    counts={}
-    for line in out.splitlines():
-        mac=line.strip()
-        if mac: counts[mac]=counts.get(mac,0)+1
-    return counts
-
-def sta_stats(pcap,sta,ap):
-    times=run(f'tshark -r "{pcap}" -Y "wlan.vht.compressed_beamforming_report && wlan.sa=={sta} && wlan.da=={ap}" -T fields -e frame.time_relative',capture=True,soft=True)
-    tvals=[float(x) for x in times.splitlines() if x.strip()]
-    if not tvals: return 0,0,0
-    dur=tvals[-1]-tvals[0] if len(tvals)>1 else 0
-    count=len(tvals)
-    rate=count/dur if dur>0 else 0
-    return count,dur,rate
+BFI_FILTER = "wlan.vht.compressed_beamforming_report"
+
+def tshark_lines(cmd):
+    """
+    Stream tshark's stdout line by line. A missing or unrunnable tshark yields
+    nothing (no BFI) instead of raising, so main() still restores the adapter.
+    """
+    try:
+        proc=subprocess.Popen(cmd,stdout=subprocess.PIPE,stderr=subprocess.DEVNULL,
+                              text=True,bufsize=1<<20)
+    except OSError as e:
+        print(f"[WARN] tshark could not be started: {e}")
+        return
+    with proc:
+        yield from proc.stdout
+
+def analyze_bfi(pcap):
+    """
+    Single tshark pass over the capture; all BFI aggregates built from one field dump.
+    tshark is started exactly once per capture, so its plugin/dissector startup
+    (~0.3 s) is paid once. Alternative if pyshark is installed: iterate
+    pyshark.FileCapture(pcap, display_filter=BFI_FILTER, use_json=True) once
+    and read the same three fields per packet.
+    """
+    cmd=["tshark","-r",pcap,"-Y",BFI_FILTER,"-T","fields",
+         "-e","wlan.da","-e","wlan.sa","-e","frame.time_relative","-E","separator=/t"]
+    print(f"[RUN] {' '.join(cmd)}")
+    total=0; ap_counts=Counter()
+    # running [min t, max t, count] per (sa,da) pair and per da (AP stream)
+    pairs=defaultdict(lambda:[math.inf,-math.inf,0])
+    aps=defaultdict(lambda:[math.inf,-math.inf,0])
+    # stream line by line: memory is bounded by the number of (sa,da) pairs,
+    # not by the number of BFI frames in the capture
+    for line in tshark_lines(cmd):
+        parts=line.rstrip("\n").split("\t")
+        if len(parts)<3: continue
+        da,sa,t=parts[0].strip(),parts[1].strip(),parts[2].strip()
+        total+=1
+        if not da: continue
+        ap_counts[da]+=1
+        if not t: continue
+        t=float(t)
+        for st in ((aps[da],pairs[(sa,da)]) if sa else (aps[da],)):
+            if t<st[0]: st[0]=t
+            if t>st[1]: st[1]=t
+            st[2]+=1
+
+    ap=ap_counts.most_common(1)[0][0] if ap_counts else None
+    rx_counts={}; sta={}
+    for (sa,da),(t0,t1,n) in pairs.items():
+        if da!=ap: continue
+        rx_counts[sa]=n
+        dur=t1-t0 if n>1 else 0
+        sta[sa]=(n,dur,n/dur if dur>0 else 0)
+    t0,t1,n=aps[ap] if ap else (0,0,0)
+    dur=t1-t0 if n>1 else 0
+    rate=(ap_counts.get(ap,0)/dur) if dur>0 else 0
+    return {"total":total,"ap":ap,"ap_counts":ap_counts,"rx_counts":rx_counts,
+            "sta":sta,"duration":dur,"rate":rate}
 
 # ---------- GUI ----------
 def ask_user():
@@ -176,49 +252,40 @@ def main():
     print(f"[CAPTURE] Observing traffic on {iface} for {DEFAULTS['CAPTURE_TIME']}s ...")
     print("[CAPTURE] Started", flush=True)
 
-    proc = subprocess.Popen(
-        ["sudo","tcpdump","-i",iface,"-s","0","-U",
-        "-G",str(DEFAULTS["CAPTURE_TIME"]),"-W","1","-w",tmp],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL
-    )
+    proc = start_capture(iface, tmp)
 
     try: proc.wait(timeout=DEFAULTS["CAPTURE_TIME"]+15)
     except subprocess.TimeoutExpired: proc.terminate()
 
     if iperf_proc and iperf_proc.poll() is None: iperf_proc.terminate()
-    os.sync(); time.sleep(0.5)
-    if not file_size_ok(tmp): restore_managed(iface); sys.exit("No capture file.")
+    fsync_file(tmp)
+    if not file_size_ok(tmp): restore_managed(iface); sys.exit("No capture file. (Did any BFI frames pass the capture filter?)")
     shutil.move(tmp,final)
     print(f"[CAPTURE] Saved: {final}")
 
-    total=tshark_count_bfi(final)
-    ap,ap_counts=detect_ap_mac(final)
+    res=analyze_bfi(final)
+    ap,ap_counts=res["ap"],res["ap_counts"]
 
     print("\n=== BFI Observation Summary ===")
     print(f"File:          {final}")
     print(f"Channel:       {ch}")
-    print(f"Total BFI:     {total}\n")
+    print(f"Total BFI:     {res['total']}\n")
 
     if ap:
         print("List of Tx [AP]:")
         print(f" {ap_counts.get(ap,0):5d} {ap}")
         print("\nList of Rx [STA]:")
-        rx_counts=list_rx_counts(final,ap)
+        rx_counts=res["rx_counts"]
         for sta,count in rx_counts.items():
             print(f" {count:5d} {sta}")
 
         print("\nBFI Rate per Rx:")
         for sta in rx_counts:
-            c,d,r=sta_stats(final,sta,ap)
+            c,d,r=res["sta"][sta]
             print(f"STA (Rx): {sta}  |  BFIs: {c}  |  Active: {d:.2f}s  |  Rate: {r:.2f} Hz")
 
         # overall BFI rate using AP frames
-        times=run(f'tshark -r "{final}" -Y "wlan.vht.compressed_beamforming_report && wlan.da=={ap}" -T fields -e frame.time_relative',
-                  capture=True,soft=True)
-        tvals=[float(x) for x in times.splitlines() if x.strip()]
-        dur=(tvals[-1]-tvals[0]) if len(tvals)>1 else 0
-        rate=(ap_counts.get(ap,0)/dur) if dur>0 else 0
+        dur,rate=res["duration"],res["rate"]
         print(f"\nAP: {ap}\nBFI Frames: {ap_counts.get(ap,0)}\nDuration: {dur:.2f}s\nOverall BFI Rate: {rate:.2f} Hz")
     else:
         print("No AP detected in capture.")
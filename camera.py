@@ -1,19 +1,31 @@
 #!/usr/bin/env python3
 import os
+import sys
 import time
 import csv
 import signal
+import shutil
+import subprocess
+import queue
+import threading
 from pathlib import Path
 
 import cv2
 import numpy as np
 
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
 # =========================
 # User settings
 # =========================
 DURATION_SECONDS = float(os.environ.get("CAM_DURATION", "30.0"))
 SAVE_EVERY_N_FRAMES = 1
+CSV_FLUSH_EVERY_N_FRAMES = 30   # ~1 s of rows lost at most on a hard kill
 PREVIEW = True
+PREVIEW_EVERY_N_FRAMES = 3
 DEPTH_VIS_ALPHA = 0.03
 
 COLOR_DEV = "/dev/video2"
@@ -26,6 +38,31 @@ IR_W, IR_H, IR_FPS = 640, 576, 30
 
 VIDEO_CODEC = "mp4v"
 
+# Per-stream image formats. JPEG for RGB and uncompressed TIFF for 16-bit
+# depth / IR are far cheaper to write than PNG; pass --lossless (or set
+# CAM_LOSSLESS=1) to store everything as PNG instead.
+LOSSLESS = "--lossless" in sys.argv[1:] or os.environ.get("CAM_LOSSLESS") == "1"
+RGB_EXT   = ".png" if LOSSLESS else ".jpg"
+DEPTH_EXT = ".png" if LOSSLESS else ".tiff"
+IR_EXT    = ".png" if LOSSLESS else ".tiff"
+
+# Encoding runs on background threads so the capture loop only reads
+WRITE_PARAMS = {
+    ".png":  [cv2.IMWRITE_PNG_COMPRESSION, 1],
+    ".jpg":  [cv2.IMWRITE_JPEG_QUALITY, 90],
+    ".tiff": [cv2.IMWRITE_TIFF_COMPRESSION, 1],
+}
+WRITE_QUEUE_SIZE = 64
+WRITE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# How long a row waits for the remaining streams once the first has a new
+# frame: about one frame period, so rgb/depth/ir of a row share an instant
+SYNC_WAIT_S = 1.0 / COLOR_FPS
+
+# Reader retry delay after a failed grab(), doubled up to the cap
+GRAB_RETRY_MIN_S = 0.002
+GRAB_RETRY_MAX_S = 0.1
+
 # =========================
 # Signal handling (CRITICAL)
 # =========================
@@ -54,14 +91,35 @@ def ensure_dirs(session_dir: Path):
     (session_dir / "images" / "depth").mkdir(parents=True, exist_ok=True)
     (session_dir / "images" / "ir").mkdir(parents=True, exist_ok=True)
 
-def as_gray(frame):
-    if frame is None:
-        return frame
-    if frame.ndim == 2:
-        return frame
-    if frame.ndim == 3:
-        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    return frame
+def _image_writer(q: queue.Queue):
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        path, img = item
+        ext = os.path.splitext(path)[1]
+        # a failed write must not kill the worker: the capture loop would
+        # then block on a full queue and shutdown on join()
+        try:
+            if ext == ".tiff" and tifffile is not None:
+                tifffile.imwrite(path, img, compression=None)
+            elif not cv2.imwrite(path, img, WRITE_PARAMS[ext]):
+                print(f"[WARN] Image write failed: {path}", flush=True)
+        except Exception as e:
+            print(f"[WARN] Image write failed: {path} ({e})", flush=True)
+
+def start_image_writers(n: int):
+    q = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    workers = [threading.Thread(target=_image_writer, args=(q,), daemon=True) for _ in range(n)]
+    for w in workers:
+        w.start()
+    return q, workers
+
+def stop_image_writers(q: queue.Queue, workers):
+    for _ in workers:
+        q.put(None)
+    for w in workers:
+        w.join()
 
 def devnode_to_index(devnode: str) -> int:
     base = os.path.basename(devnode)
@@ -78,6 +136,70 @@ def open_v4l2(devnode, w, h, fps):
     cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
     return cap
 
+def _reader_loop(cap, lock: threading.Lock, slot: list, stop: threading.Event):
+    backoff = GRAB_RETRY_MIN_S
+    while not stop.is_set():
+        # grab() returns as soon as the frame is latched; stamp it there,
+        # before the (slower) decode in retrieve()
+        ok = cap.grab()
+        t = now_ms()
+        frame = None
+        if ok:
+            ok, frame = cap.retrieve()
+        with lock:
+            slot[0] = ok
+            slot[1] = frame
+            slot[2] += 1
+            slot[3] = t
+        if ok:
+            backoff = GRAB_RETRY_MIN_S
+        else:
+            # device not delivering (unplugged / stalled): back off instead
+            # of spinning on grab(); stop.wait keeps shutdown prompt
+            stop.wait(backoff)
+            backoff = min(backoff * 2, GRAB_RETRY_MAX_S)
+
+def start_reader(cap, stop: threading.Event):
+    """
+    One thread per device keeps the newest frame in slot = [ok, frame, seq, grab_ms],
+    so the three V4L2 reads block in parallel instead of back to back.
+    """
+    lock = threading.Lock()
+    slot = [False, None, 0, 0]
+    th = threading.Thread(target=_reader_loop, args=(cap, lock, slot, stop), daemon=True)
+    th.start()
+    return lock, slot, th
+
+def take_latest(reader, last_seq: int):
+    lock, slot, _ = reader
+    with lock:
+        ok, frame, seq, t = slot
+    if seq == last_seq:
+        return False, None, seq, 0
+    return ok, frame, seq, t
+
+def take_synced(readers, seqs: list, wait_s: float, until: float):
+    """
+    One row's worth of frames: the newest unconsumed (ok, frame, grab_ms) of
+    every reader. Waits until all readers have a new seq, or until wait_s has
+    passed since the first one did; a stream that misses that window is
+    reported as not ok for this row. seqs is updated in place.
+    """
+    got = [None] * len(readers)
+    first = None
+    while not STOP_REQUESTED and mono_s() < until:
+        for i, rd in enumerate(readers):
+            ok, frame, seq, t = take_latest(rd, seqs[i])
+            if seq != seqs[i]:
+                seqs[i] = seq
+                got[i] = (ok, frame, t)
+                if first is None:
+                    first = mono_s()
+        if first is not None and (all(got) or mono_s() - first >= wait_s):
+            break
+        time.sleep(0.001)
+    return [g or (False, None, 0) for g in got]
+
 def clamp(x, lo, hi):
     return max(lo, min(hi, x))
 
@@ -86,29 +208,46 @@ def compute_measured_fps(csv_path: Path):
     with open(csv_path) as f:
         r = csv.DictReader(f)
         for row in r:
-            if row["rgb_png"]:
+            if row["rgb_file"]:
                 ts.append(int(row["unix_ms"]))
     if len(ts) < 2:
         return float(COLOR_FPS)
     dur = (ts[-1] - ts[0]) / 1000.0
     return clamp((len(ts) - 1) / dur if dur > 0 else COLOR_FPS, 1.0, 120.0)
 
-def encode_rgb_video_from_png(rgb_dir: Path, out_path: Path, fps: float):
-    frames = sorted(rgb_dir.glob("rgb_*.png"))
-    first = cv2.imread(str(frames[0]))
-    h, w = first.shape[:2]
-    vw = cv2.VideoWriter(
+def open_video_writer(out_path: Path, frame, fps: float):
+    h, w = frame.shape[:2]
+    return cv2.VideoWriter(
         str(out_path),
         cv2.VideoWriter_fourcc(*VIDEO_CODEC),
         fps,
         (w, h),
     )
-    for p in frames:
-        img = cv2.imread(str(p))
-        if img is not None:
-            vw.write(img)
-    vw.release()
-    return len(frames)
+
+def retime_video(raw_path: Path, out_path: Path, fps: float):
+    """
+    Frames are encoded live at the nominal COLOR_FPS. If the measured rate
+    differs materially, rescale the container timestamps with ffmpeg
+    (stream copy, no re-encode); otherwise just keep the raw file.
+    """
+    if abs(fps - COLOR_FPS) / COLOR_FPS < 0.01:
+        raw_path.replace(out_path)
+        return True
+    if not shutil.which("ffmpeg"):
+        print("[WARN] ffmpeg not found; keeping video at nominal FPS.")
+        raw_path.replace(out_path)
+        return False
+    res = subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error",
+         "-itsscale", f"{COLOR_FPS / fps:.6f}", "-i", str(raw_path),
+         "-c", "copy", str(out_path)],
+    )
+    if res.returncode != 0:
+        print("[WARN] ffmpeg retime failed; keeping video at nominal FPS.")
+        raw_path.replace(out_path)
+        return False
+    raw_path.unlink()
+    return True
 
 # =========================
 # Main
@@ -136,78 +275,128 @@ def main():
 
     csv_path = session_dir / "frames.csv"
 
-    with open(csv_path, "w", newline="") as f:
+    with open(csv_path, "w", newline="", buffering=1 << 16) as f:
         writer = csv.writer(f)
         writer.writerow([
             "frame_idx","unix_ms",
             "rgb_ok","depth_ok","ir_ok",
-            "rgb_png","depth_png","ir_png"
+            "rgb_file","depth_file","ir_file",
+            "rgb_grab_ms","depth_grab_ms","ir_grab_ms"
         ])
 
         print(f"[INFO] Session directory: {session_dir}")
         print(f"[INFO] Capture duration target: {DURATION_SECONDS}s")
 
+        raw_video = video_dir / "rgb_raw.mp4"
+        vw = None
+        written = 0
+
+        write_q, writers = start_image_writers(WRITE_WORKERS)
+
+        # Preview buffers, reused every frame (cv2 reallocates if the shape differs)
+        depth_u8 = np.empty((DEPTH_H, DEPTH_W), np.uint8)
+        dv_buf = np.empty((DEPTH_H, DEPTH_W, 3), np.uint8)
+        ir_u8 = np.empty((IR_H, IR_W), np.uint8)
+
+        stop_readers = threading.Event()
+        readers = [start_reader(cap, stop_readers) for cap in (color_cap, depth_cap, ir_cap)]
+        seqs = [0, 0, 0]
+        depth_is_gray = ir_is_gray = None
+
+        # Plain-string filename prefixes; avoids building Path objects per frame
+        rgb_pref = f"{rgb_dir}{os.sep}rgb_"
+        depth_pref = f"{depth_dir}{os.sep}depth_"
+        ir_pref = f"{ir_dir}{os.sep}ir_"
+
+        csv_rows = []
+
         deadline = mono_s() + DURATION_SECONDS
         frame_idx = 0
 
         try:
             while mono_s() < deadline and not STOP_REQUESTED:
-                ok_c, color = color_cap.read()
-                ok_d, depth = depth_cap.read()
-                ok_i, ir    = ir_cap.read()
+                # one row per RGB/depth/IR triple, not per stream update
+                (ok_c, color, t_c), (ok_d, depth, t_d), (ok_i, ir, t_i) = \
+                    take_synced(readers, seqs, SYNC_WAIT_S, deadline)
 
                 if not (ok_c or ok_d or ok_i):
-                    time.sleep(0.001)
                     continue
 
-                t = now_ms()
+                # depth/IR normally arrive single-channel; check that once per stream
+                if ok_d:
+                    if depth_is_gray is None:
+                        depth_is_gray = depth.ndim == 2
+                    if not depth_is_gray:
+                        depth = cv2.cvtColor(depth, cv2.COLOR_BGR2GRAY)
+                if ok_i:
+                    if ir_is_gray is None:
+                        ir_is_gray = ir.ndim == 2
+                    if not ir_is_gray:
+                        ir = cv2.cvtColor(ir, cv2.COLOR_BGR2GRAY)
+
+                # row time = RGB latch time, else the earliest latched stream
+                t = t_c if ok_c else min(x for ok, x in ((ok_d, t_d), (ok_i, t_i)) if ok)
                 rgb_p = depth_p = ir_p = ""
 
                 if frame_idx % SAVE_EVERY_N_FRAMES == 0:
                     if ok_c:
-                        rgb_p = rgb_dir / f"rgb_{frame_idx:06d}_{t}.png"
-                        cv2.imwrite(str(rgb_p), color)
+                        rgb_p = f"{rgb_pref}{frame_idx:06d}_{t}{RGB_EXT}"
+                        write_q.put((rgb_p, color))
+                        if vw is None:
+                            vw = open_video_writer(raw_video, color, COLOR_FPS)
+                        vw.write(color)
+                        written += 1
                     if ok_d:
-                        depth_p = depth_dir / f"depth_{frame_idx:06d}_{t}.png"
-                        cv2.imwrite(str(depth_p), as_gray(depth))
+                        depth_p = f"{depth_pref}{frame_idx:06d}_{t}{DEPTH_EXT}"
+                        write_q.put((depth_p, depth))
                     if ok_i:
-                        ir_p = ir_dir / f"ir_{frame_idx:06d}_{t}.png"
-                        cv2.imwrite(str(ir_p), as_gray(ir))
+                        ir_p = f"{ir_pref}{frame_idx:06d}_{t}{IR_EXT}"
+                        write_q.put((ir_p, ir))
 
-                writer.writerow([
+                csv_rows.append([
                     frame_idx, t,
                     int(ok_c), int(ok_d), int(ok_i),
-                    str(rgb_p), str(depth_p), str(ir_p)
+                    rgb_p, depth_p, ir_p,
+                    t_c if ok_c else "", t_d if ok_d else "", t_i if ok_i else ""
                 ])
 
                 frame_idx += 1
+                if frame_idx % CSV_FLUSH_EVERY_N_FRAMES == 0:
+                    writer.writerows(csv_rows)
+                    csv_rows.clear()
 
-                if PREVIEW:
+                if PREVIEW and frame_idx % PREVIEW_EVERY_N_FRAMES == 0:
                     if ok_c:
                         cv2.imshow("RGB", color)
                     if ok_d:
-                        dv = cv2.applyColorMap(
-                            cv2.convertScaleAbs(as_gray(depth), alpha=DEPTH_VIS_ALPHA),
-                            cv2.COLORMAP_JET
-                        )
-                        cv2.imshow("Depth", dv)
+                        depth_u8 = cv2.convertScaleAbs(depth, dst=depth_u8, alpha=DEPTH_VIS_ALPHA)
+                        dv_buf = cv2.applyColorMap(depth_u8, cv2.COLORMAP_JET, dst=dv_buf)
+                        cv2.imshow("Depth", dv_buf)
                     if ok_i:
-                        iv = cv2.normalize(as_gray(ir), None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-                        cv2.imshow("IR", iv)
+                        ir_u8 = cv2.normalize(ir, ir_u8, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+                        cv2.imshow("IR", ir_u8)
                     if cv2.waitKey(1) == 27:
                         break
 
         finally:
+            writer.writerows(csv_rows)
+            stop_readers.set()
+            for _, _, th in readers:
+                th.join()
+            stop_image_writers(write_q, writers)
             color_cap.release()
             depth_cap.release()
             ir_cap.release()
+            if vw is not None:
+                vw.release()
             if PREVIEW:
                 cv2.destroyAllWindows()
 
     print("[POST] Computing measured FPS...")
     fps = compute_measured_fps(csv_path)
     out_video = video_dir / "rgb_measured_fps.mp4"
-    written = encode_rgb_video_from_png(rgb_dir, out_video, fps)
+    if written:
+        retime_video(raw_video, out_video, fps)
 
     print(f"[DONE] Encoded {written} frames @ {fps:.3f} fps")
     print(f"[DONE] RGB video: {out_video}")
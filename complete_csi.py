@@ -15,7 +15,7 @@ NEW features:
     1. Amplitude data over time (mean amplitude vs frame index)
     2. Phase data over time (mean phase vs frame index)
     3. Amplitude heatmap (frames × subcarriers)
-    4. Timestamps saved to timestamps.txt
+    4. Timestamps saved to timestamps.txt (and timestamps.npy)
     5. FPS (sampling rate) derived from timestamps
     6. Frequency mapping for tones (CSV + amplitude-vs-frequency plot)
     7. CSI summary report saved to csi_summary.txt
@@ -26,82 +26,93 @@ All outputs are saved into a folder named after the .csi file
 
 import sys
 import os
+import functools
 import numpy as np
-import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
 
-import tkinter as tk
-from tkinter import filedialog, messagebox
+try:
+    import pyfpng  # optional: fast PNG encoder for the amplitude heatmap
+except ImportError:
+    pyfpng = None
 
 from picoscenes import Picoscenes
 
+from _csi_common import (
+    pick_file, u64_to_mac, to_soa, subcarrier_index, row_col_means,
+)
+
 
 # -------------------------------------------------------------
-#                   FILE PICKER
+#                   HEATMAP DOWNSAMPLING
 # -------------------------------------------------------------
-def pick_file():
-    root = tk.Tk()
-    root.withdraw()
-    root.update()
-    path = filedialog.askopenfilename(
-        title="Select PicoScenes .csi file",
-        filetypes=[("PicoScenes CSI", "*.csi"), ("All files", "*.*")]
-    )
-    root.destroy()
-    if not path:
-        raise SystemExit("No file selected.")
-    return path
+HEATMAP_MAX_ROWS = 2000
 
 
-# -------------------------------------------------------------
-#                   MAC PARSER
-# -------------------------------------------------------------
-def mac_to_str(field):
+@functools.lru_cache(maxsize=None)
+def viridis_lut():
     """
-    Convert a 6-byte address (list/ndarray/etc.) to 'AA:BB:CC:DD:EE:FF'.
-    Returns None if it cannot be interpreted as a MAC.
+    viridis as a 256-entry RGB table: a uint8 matrix is colour-mapped with a
+    single fancy-index (LUT[A8]) instead of going through Normalize/RGBA floats.
     """
-    if field is None:
-        return None
-    try:
-        arr = np.array(field, dtype=np.uint8).flatten()
-    except Exception:
-        return None
+    return (_pyplot().get_cmap("viridis")(np.arange(256))[:, :3] * 255).astype(np.uint8)
 
-    if arr.size < 6:
-        return None
 
-    vals = [int(x) & 0xFF for x in arr[:6]]
-    return ":".join(f"{b:02X}" for b in vals)
+def downsample_rows(M, target=HEATMAP_MAX_ROWS):
+    """
+    Block-average the rows of an (N, K) matrix down to `target` rows so
+    imshow never rasterises more rows than the PNG can show. Trailing
+    rows that do not fill a whole block are dropped.
+    """
+    n = M.shape[0]
+    if n <= target:
+        return M
+    block = n // target
+    return M[:block * target].reshape(target, block, M.shape[1]).mean(axis=1)
 
 
 # -------------------------------------------------------------
-#                   TIMESTAMP EXTRACTOR
+#                   MAG / PHASE CONVERSION
 # -------------------------------------------------------------
-def get_timestamp(rx_basic):
+def _f32_generic(v):
+    return np.asarray(v, dtype=np.float32).ravel()
+
+
+def f32_converter(sample):
     """
-    Return one timestamp in microseconds from RxSBasic dict.
-    Tries several key spellings (Timestamp/SystemTime).
+    Pick the Mag/Phase -> 1-D float32 conversion once, from the type of the
+    first CSI block's Mag: raw buffers are viewed in place with frombuffer,
+    flat lists go through fromiter (no intermediate float64 array), anything
+    else uses asarray.
     """
-    if not isinstance(rx_basic, dict):
-        return None
-
-    for key in ("Timestamp", "timestamp", "SystemTime", "systemTime"):
-        if key in rx_basic:
-            arr = np.array(rx_basic[key]).flatten()
-            if arr.size:
-                return int(arr[0])
-    return None
+    if isinstance(sample, (bytes, bytearray, memoryview)):
+        return lambda v: np.frombuffer(v, dtype=np.float32)
+    if isinstance(sample, list) and sample and not isinstance(sample[0], (list, tuple)):
+        return lambda v: np.fromiter(v, dtype=np.float32, count=len(v))
+    return _f32_generic
 
 
 # -------------------------------------------------------------
 #                   SAVE PLOTS UTILITY
 # -------------------------------------------------------------
-def save_plot(fig, folder, name):
+@functools.lru_cache(maxsize=None)
+def _pyplot():
+    """
+    Import pyplot on first use. All plots here go straight to PNG, so the
+    Agg backend is selected up front and no GUI backend is probed.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def save_plot(fig, folder, name, close=True):
     os.makedirs(folder, exist_ok=True)
     path = os.path.join(folder, name)
     fig.savefig(path, dpi=200, bbox_inches="tight")
     print(f"[+] Saved plot: {path}")
-    plt.close(fig)
+    if close:
+        _pyplot().close(fig)
 
 
 # -------------------------------------------------------------
@@ -119,9 +130,14 @@ def analyze_csi(path):
     ps = Picoscenes(path)
     frames = ps.raw
 
-    # CSI-bearing frames only
-    csi_frames = [f for f in frames if isinstance(f.get("CSI"), dict)]
-    num_csi = len(csi_frames)
+    # ---------------------------------------------------------
+    #   SINGLE PASS OVER ALL FRAMES
+    # ---------------------------------------------------------
+    soa = to_soa(frames)
+    num_frames = len(frames)
+    csi_blocks = soa["csi_blocks"]
+    timestamps = soa["ts_us"]
+    num_csi = int(soa["has_csi"].sum())
 
     if num_csi == 0:
         print("No frames with 'CSI' field found in this file.")
@@ -130,115 +146,95 @@ def analyze_csi(path):
     # ---------------------------------------------------------
     #   MAC EXTRACTION OVER ALL FRAMES
     # ---------------------------------------------------------
-    all_macs = set()
     tx_primary = None
     rx_primary = None
 
-    for f in frames:
-        sh = f.get("StandardHeader") or f.get("standardHeader")
-        if not isinstance(sh, dict):
-            continue
+    keys = soa["addr_keys"]                           # (F, 3)
+    valid = soa["addr_valid"]
+    all_macs = {u64_to_mac(k) for k in np.unique(keys[valid])}
 
-        # Try both capitalizations
-        A1 = sh.get("Addr1") or sh.get("addr1")   # receiver
-        A2 = sh.get("Addr2") or sh.get("addr2")   # transmitter
-        A3 = sh.get("Addr3") or sh.get("addr3")   # BSSID / routing
-
-        for addr in (A1, A2, A3):
-            mac = mac_to_str(addr)
-            if mac is None:
-                continue
-            if mac in ("00:00:00:00:00:00", "FF:FF:FF:FF:FF:FF"):
-                continue
-            all_macs.add(mac)
-
-        # first non-broadcast TX/RX pair as "primary"
-        if tx_primary is None and A1 is not None and A2 is not None:
-            rx_mac = mac_to_str(A1)
-            tx_mac = mac_to_str(A2)
-            if (
-                rx_mac not in (None, "00:00:00:00:00:00", "FF:FF:FF:FF:FF:FF")
-                and tx_mac not in (None, "00:00:00:00:00:00", "FF:FF:FF:FF:FF:FF")
-            ):
-                tx_primary, rx_primary = tx_mac, rx_mac
+    # first non-broadcast TX/RX pair as "primary"
+    pair = valid[:, 0] & valid[:, 1]
+    if pair.any():
+        i = int(np.argmax(pair))
+        rx_primary = u64_to_mac(keys[i, 0])
+        tx_primary = u64_to_mac(keys[i, 1])
 
     # ---------------------------------------------------------
     #   TIMESTAMPS & RATES (CSI FRAMES ONLY)
     # ---------------------------------------------------------
-    timestamps = []
-    for f in csi_frames:
-        rx_basic = f.get("RxSBasic") or f.get("rxSBasic")
-        ts = get_timestamp(rx_basic)
-        if ts is not None:
-            timestamps.append(ts)
-
     time_span_sec = None
     csi_rate = None
     fps = None
 
-    if len(timestamps) >= 2:
-        t_min = min(timestamps)
-        t_max = max(timestamps)
+    if timestamps.size >= 2:
+        t_min = timestamps.min()
+        t_max = timestamps.max()
         time_span_sec = (t_max - t_min) / 1e6  # microseconds → seconds
         if time_span_sec > 0:
             csi_rate = num_csi / time_span_sec
 
-        ts_sec = np.array(timestamps) / 1e6
+        ts_sec = timestamps / 1e6
         dt = np.diff(ts_sec)
-        fps = 1.0 / np.mean(dt)
+        fps = 1.0 / dt.mean()
 
     # Save timestamps to file (NEW #4)
     ts_path = os.path.join(out_dir, "timestamps.txt")
-    with open(ts_path, "w") as f:
-        for t in timestamps:
-            f.write(str(t) + "\n")
+    np.savetxt(ts_path, timestamps, fmt="%d")
+    # binary copy for downstream tools (much faster to reload than text)
+    np.save(os.path.splitext(ts_path)[0] + ".npy", timestamps)
     print(f"[+] Saved timestamp list → {ts_path}")
 
     # ---------------------------------------------------------
     #   BUILD AMPLITUDE / PHASE MATRICES ACROSS ALL CSI FRAMES
     # ---------------------------------------------------------
-    Amp_list = []
-    Phase_list = []
-    csi_meta = None
-
-    for f in csi_frames:
-        c = f.get("CSI")
-        if not isinstance(c, dict):
-            continue
-
-        if csi_meta is None:
-            csi_meta = c  # first CSI block used for metadata (tones, BW, etc.)
-
-        mag = np.array(c.get("Mag"))
-        ph = np.array(c.get("Phase"))
+    # Rows go straight into preallocated float32 matrices (no per-frame
+    # list, no vstack copy). The first non-empty frame fixes K; frames with
+    # a different #tones are skipped.
+    csi_meta = csi_blocks[0]  # first CSI block: metadata (tones, BW, etc.)
+    Amp = Phase = None
+    N = 0
+
+    to_f32 = f32_converter(csi_meta.get("Mag"))
+    for c in csi_blocks:
+        try:
+            mag = to_f32(c.get("Mag"))
+            ph = to_f32(c.get("Phase"))
+        except (TypeError, ValueError):
+            mag = _f32_generic(c.get("Mag"))
+            ph = _f32_generic(c.get("Phase"))
 
         if mag.size == 0 or ph.size == 0:
             continue
 
-        mag = mag.flatten()
-        ph = ph.flatten()
+        if Amp is None:
+            K = mag.size
+            Amp = np.empty((num_csi, K), dtype=np.float32)
+            Phase = np.empty((num_csi, K), dtype=np.float32)
 
         # Ensure all frames have same #tones
-        if Amp_list and mag.size != Amp_list[0].size:
+        if mag.size != K or ph.size != K:
             # Skip weird frames with mismatched size
             continue
 
-        Amp_list.append(mag)
-        Phase_list.append(ph)
+        Amp[N] = mag
+        Phase[N] = ph
+        N += 1
 
-    if not Amp_list:
+    if N == 0:
         raise RuntimeError("No valid CSI Mag/Phase arrays found in frames.")
 
-    Amp = np.vstack(Amp_list)      # shape: (N, K)
-    Phase = np.vstack(Phase_list)  # shape: (N, K)
-    N, K = Amp.shape
+    Amp = Amp[:N]      # shape: (N, K)
+    Phase = Phase[:N]  # shape: (N, K)
+
+    # All reductions the plots need, computed once
+    amp_row_mean, amp_col_mean = row_col_means(Amp)
+    phase_row_mean, _ = row_col_means(Phase)
 
     # ---------------------------------------------------------
     #   SUBCARRIER INFO
     # ---------------------------------------------------------
-    sub_idx = np.array(
-        csi_meta.get("SubcarrierIndex") or []
-    ).flatten()
+    sub_idx = subcarrier_index(csi_meta.get("SubcarrierIndex"))
     if sub_idx.size == 0:
         num_sub = K
     else:
@@ -248,7 +244,7 @@ def analyze_csi(path):
     #   PRINT CONSOLE SUMMARY (original behavior)
     # ---------------------------------------------------------
     print("====== CSI FILE SUMMARY (Python) ======")
-    print(f"Total frames parsed      : {len(frames)}")
+    print(f"Total frames parsed      : {num_frames}")
     print(f"Frames with CSI          : {num_csi}")
     if time_span_sec is not None:
         print(f"Capture time span        : {time_span_sec:.3f} s")
@@ -279,105 +275,126 @@ def analyze_csi(path):
 
     print("\n(Plots and summary files are being generated...)\n")
 
+    plt = _pyplot()
+
+    # Matplotlib figures are drawn and saved on this thread (pyplot is not
+    # thread-safe); only the GIL-free fpng heatmap encode runs on a worker.
+    save_pool = heat_job = None
+
+    # All 8x4 line plots share one Figure/Axes, cleared between plots;
+    # the heatmap gets its own figure.
+    fig, ax = plt.subplots(figsize=(8, 4))
+
     # ---------------------------------------------------------
     #   PLOT: AMPLITUDE OF FIRST FRAME (Frame 1)
     # ---------------------------------------------------------
-    fig = plt.figure(figsize=(8, 4))
-    plt.plot(Amp[0])
-    plt.xlabel("Subcarrier Index")
-    plt.ylabel("Amplitude")
-    plt.title("CSI Amplitude – Frame 1")
-    plt.grid(True)
-    save_plot(fig, out_dir, "amp_frame1.png")
+    ax.clear()
+    ax.plot(Amp[0])
+    ax.set_xlabel("Subcarrier Index")
+    ax.set_ylabel("Amplitude")
+    ax.set_title("CSI Amplitude – Frame 1")
+    ax.grid(True)
+    save_plot(fig, out_dir, "amp_frame1.png", close=False)
 
     # ---------------------------------------------------------
     #   PLOT: PHASE OF FIRST FRAME (Frame 1)
     # ---------------------------------------------------------
-    fig = plt.figure(figsize=(8, 4))
-    plt.plot(Phase[0])
-    plt.xlabel("Subcarrier Index")
-    plt.ylabel("Phase (radians)")
-    plt.title("CSI Phase – Frame 1")
-    plt.grid(True)
-    save_plot(fig, out_dir, "phase_frame1.png")
+    ax.clear()
+    ax.plot(Phase[0])
+    ax.set_xlabel("Subcarrier Index")
+    ax.set_ylabel("Phase (radians)")
+    ax.set_title("CSI Phase – Frame 1")
+    ax.grid(True)
+    save_plot(fig, out_dir, "phase_frame1.png", close=False)
 
     # ---------------------------------------------------------
     #   NEW #1: AMPLITUDE OVER TIME (mean amplitude per frame)
     # ---------------------------------------------------------
-    mean_amp = Amp.mean(axis=1)
-    fig = plt.figure(figsize=(8, 4))
-    plt.plot(mean_amp)
-    plt.xlabel("Frame Index")
-    plt.ylabel("Mean Amplitude")
-    plt.title("Mean CSI Amplitude Over Time")
-    plt.grid(True)
-    save_plot(fig, out_dir, "amplitude_over_time.png")
+    mean_amp = amp_row_mean
+    ax.clear()
+    ax.plot(mean_amp)
+    ax.set_xlabel("Frame Index")
+    ax.set_ylabel("Mean Amplitude")
+    ax.set_title("Mean CSI Amplitude Over Time")
+    ax.grid(True)
+    save_plot(fig, out_dir, "amplitude_over_time.png", close=False)
 
     # ---------------------------------------------------------
     #   NEW #2: PHASE OVER TIME (mean phase per frame)
     # ---------------------------------------------------------
-    mean_phase = Phase.mean(axis=1)
-    fig = plt.figure(figsize=(8, 4))
-    plt.plot(mean_phase)
-    plt.xlabel("Frame Index")
-    plt.ylabel("Mean Phase (rad)")
-    plt.title("Mean CSI Phase Over Time")
-    plt.grid(True)
-    save_plot(fig, out_dir, "phase_over_time.png")
+    mean_phase = phase_row_mean
+    ax.clear()
+    ax.plot(mean_phase)
+    ax.set_xlabel("Frame Index")
+    ax.set_ylabel("Mean Phase (rad)")
+    ax.set_title("Mean CSI Phase Over Time")
+    ax.grid(True)
+    save_plot(fig, out_dir, "phase_over_time.png", close=False)
 
     # ---------------------------------------------------------
     #   NEW #3: AMPLITUDE HEATMAP
     # ---------------------------------------------------------
-    fig = plt.figure(figsize=(8, 5))
-    plt.imshow(Amp, aspect="auto")
-    plt.xlabel("Subcarrier Index")
-    plt.ylabel("Frame Index")
-    plt.title("CSI Amplitude Over Time (Heatmap)")
-    plt.colorbar(label="Amplitude")
-    save_plot(fig, out_dir, "amplitude_heatmap.png")
+    # Rows block-averaged down to HEATMAP_MAX_ROWS, then rendered from a
+    # uint8 copy; colorbar ticks are relabelled back to amplitude units.
+    A_plot = downsample_rows(Amp)
+    a_min, a_max = float(A_plot.min()), float(A_plot.max())
+    scale = 255.0 / (a_max - a_min) if a_max > a_min else 0.0
+    A8 = ((A_plot - a_min) * scale).astype(np.uint8)
+    heat_path = os.path.join(out_dir, "amplitude_heatmap.png")
+    if pyfpng is not None:
+        # Fast path: colour-map the uint8 matrix and encode it directly with
+        # fpng (raw frames x subcarriers image, no axes / colorbar).
+        # The encode runs in C, so it overlaps with the remaining plots.
+        rgb = viridis_lut()[A8]
+        save_pool = ThreadPoolExecutor(max_workers=1)
+        heat_job = save_pool.submit(pyfpng.encode_image_to_file, heat_path, rgb)
+    else:
+        hfig, hax = plt.subplots(figsize=(8, 5))
+        im = hax.imshow(A8, aspect="auto", cmap="viridis", vmin=0, vmax=255,
+                        extent=[0, K, N, 0])
+        hax.set_xlabel("Subcarrier Index")
+        hax.set_ylabel("Frame Index")
+        hax.set_title("CSI Amplitude Over Time (Heatmap)")
+        cbar = hfig.colorbar(im, ax=hax, label="Amplitude")
+        cbar.set_ticks(np.linspace(0, 255, 6))
+        cbar.set_ticklabels([f"{v:.2f}" for v in np.linspace(a_min, a_max, 6)])
+        save_plot(hfig, out_dir, "amplitude_heatmap.png")
 
     # ---------------------------------------------------------
     #   NEW #6: FREQUENCY MAPPING FOR TONES
     # ---------------------------------------------------------
     freq_path = os.path.join(out_dir, "frequency_map.csv")
     try:
-        raw_idx = csi_meta.get("SubcarrierIndex")
-        if raw_idx is None:
+        if csi_meta.get("SubcarrierIndex") is None:
             raise ValueError("SubcarrierIndex missing from CSI block.")
 
-        sub_idx = np.array(raw_idx).astype(int).flatten()
         if sub_idx.size == 0:
             raise ValueError("SubcarrierIndex array is empty.")
 
         delta_f = float(csi_meta.get("SubcarrierBandwidth", 0.0))
         freq_offsets = sub_idx * delta_f  # Hz
 
-        # Build 2-column array for CSV (robust for 1 or many tones)
-        if sub_idx.size == 1:
-            data = np.array([[sub_idx[0], freq_offsets[0]]], dtype=float)
-        else:
-            data = np.column_stack((sub_idx, freq_offsets.astype(float)))
-
+        # column_stack handles the 1-tone case as well
         np.savetxt(
             freq_path,
-            data,
+            np.column_stack((sub_idx, freq_offsets)),
             delimiter=",",
             header="SubcarrierIndex,FreqOffset(Hz)",
-            fmt="%.0f,%.6f",
+            fmt=("%d", "%.6f"),
             comments=""
         )
         print(f"[+] Saved tone frequency map → {freq_path}")
 
         # Plot mean amplitude vs frequency offset
-        fig = plt.figure(figsize=(8, 4))
+        ax.clear()
         # For safety, if Amp has different #tones than subcarriers, slice
         K_eff = min(Amp.shape[1], freq_offsets.size)
-        plt.plot(freq_offsets[:K_eff], Amp.mean(axis=0)[:K_eff])
-        plt.xlabel("Frequency Offset (Hz)")
-        plt.ylabel("Mean Amplitude")
-        plt.title("Mean CSI Amplitude vs Frequency Offset")
-        plt.grid(True)
-        save_plot(fig, out_dir, "freq_amp_plot.png")
+        ax.plot(freq_offsets[:K_eff], amp_col_mean[:K_eff])
+        ax.set_xlabel("Frequency Offset (Hz)")
+        ax.set_ylabel("Mean Amplitude")
+        ax.set_title("Mean CSI Amplitude vs Frequency Offset")
+        ax.grid(True)
+        save_plot(fig, out_dir, "freq_amp_plot.png", close=False)
 
     except Exception as e:
         print(f"[!] Frequency mapping skipped: {e}")
@@ -385,93 +402,104 @@ def analyze_csi(path):
     # ---------------------------------------------------------
     #   TIMELINE PLOT (original feature, now saved)
     # ---------------------------------------------------------
-    if timestamps:
-        ts_sorted = sorted(timestamps)
-        t0 = ts_sorted[0]
-        t_rel = [(t - t0) / 1e6 for t in ts_sorted]  # seconds
-        fig = plt.figure(figsize=(8, 4))
-        plt.plot(t_rel, range(1, len(t_rel) + 1))
-        plt.xlabel("Time since first CSI frame (s)")
-        plt.ylabel("Cumulative CSI packets")
-        plt.title("CSI Packet Timeline")
-        plt.grid(True)
-        save_plot(fig, out_dir, "timeline.png")
+    if timestamps.size:
+        ts_sorted = np.sort(timestamps)
+        t_rel = (ts_sorted - ts_sorted[0]) / 1e6  # seconds
+        ax.clear()
+        ax.plot(t_rel, range(1, len(t_rel) + 1))
+        ax.set_xlabel("Time since first CSI frame (s)")
+        ax.set_ylabel("Cumulative CSI packets")
+        ax.set_title("CSI Packet Timeline")
+        ax.grid(True)
+        save_plot(fig, out_dir, "timeline.png", close=False)
+
+    plt.close(fig)
 
     # ---------------------------------------------------------
     #   NEW #7: CSI SUMMARY REPORT FILE
     # ---------------------------------------------------------
     summary_path = os.path.join(out_dir, "csi_summary.txt")
-    with open(summary_path, "w") as f:
-        f.write("========== CSI SUMMARY REPORT ==========\n")
-        f.write(f"Filename: {path}\n")
-        f.write(f"Total frames parsed      : {len(frames)}\n")
-        f.write(f"Frames with CSI          : {num_csi}\n")
-        f.write(f"Subcarriers per frame    : {num_sub}\n")
-
-        f.write("\n---- Timing ----\n")
-        if time_span_sec is not None:
-            f.write(f"Capture duration         : {time_span_sec:.3f} s\n")
-        else:
-            f.write("Capture duration         : N/A\n")
-        if csi_rate is not None:
-            f.write(f"Average CSI rate         : {csi_rate:.2f} packets/s\n")
-        else:
-            f.write("Average CSI rate         : N/A\n")
-        if fps is not None:
-            f.write(f"Derived FPS (from dt)    : {fps:.2f} Hz\n")
-        else:
-            f.write("Derived FPS (from dt)    : N/A\n")
-
-        f.write("\n---- MAC Addresses ----\n")
-        if all_macs:
-            for m in sorted(all_macs):
-                f.write(m + "\n")
-        else:
-            f.write("<none>\n")
-        f.write("\nPrimary TX MAC: " + str(tx_primary) + "\n")
-        f.write("Primary RX MAC: " + str(rx_primary) + "\n")
-
-        # ---------- NEW: TX/RX Antenna Count + MAC ----------
-        tx_ant = csi_meta.get("numTx")
-        rx_ant = csi_meta.get("numRx")
+    # Report lines are collected in a list and written with a single call.
+    buf = []
+    w = buf.append
+    w("========== CSI SUMMARY REPORT ==========\n")
+    w(f"Filename: {path}\n")
+    w(f"Total frames parsed      : {num_frames}\n")
+    w(f"Frames with CSI          : {num_csi}\n")
+    w(f"Subcarriers per frame    : {num_sub}\n")
+
+    w("\n---- Timing ----\n")
+    if time_span_sec is not None:
+        w(f"Capture duration         : {time_span_sec:.3f} s\n")
+    else:
+        w("Capture duration         : N/A\n")
+    if csi_rate is not None:
+        w(f"Average CSI rate         : {csi_rate:.2f} packets/s\n")
+    else:
+        w("Average CSI rate         : N/A\n")
+    if fps is not None:
+        w(f"Derived FPS (from dt)    : {fps:.2f} Hz\n")
+    else:
+        w("Derived FPS (from dt)    : N/A\n")
 
-        try:
-            tx_ant = int(tx_ant)
-        except:
-            tx_ant = "N/A"
-        try:
-            rx_ant = int(rx_ant)
-        except:
-            rx_ant = "N/A"
-
-        f.write("\n---- Antenna Information ----\n")
-        f.write(f"TX Antennas (numTx): {tx_ant}    MAC: {tx_primary}\n")
-        f.write(f"RX Antennas (numRx): {rx_ant}    MAC: {rx_primary}\n")
-
-        # ---------- NEW: CSI matrix info ----------
-        f.write("\n---- CSI Matrix ----\n")
-        f.write(
-            f"CSI matrix shape (frames x tones): {Amp.shape[0]} x {Amp.shape[1]}\n"
-        )
+    w("\n---- MAC Addresses ----\n")
+    if all_macs:
+        for m in sorted(all_macs):
+            w(m + "\n")
+    else:
+        w("<none>\n")
+    w("\nPrimary TX MAC: " + str(tx_primary) + "\n")
+    w("Primary RX MAC: " + str(rx_primary) + "\n")
 
-        # first few rows of data (amplitude)
-        preview_rows = min(5, Amp.shape[0])
-        f.write(f"\nFirst {preview_rows} rows of amplitude matrix:\n")
-        for i in range(preview_rows):
-            row_str = ", ".join(f"{v:.4f}" for v in Amp[i])
-            f.write(f"Row {i}: {row_str}\n")
+    # ---------- NEW: TX/RX Antenna Count + MAC ----------
+    tx_ant = csi_meta.get("numTx")
+    rx_ant = csi_meta.get("numRx")
 
-        # value of all subcarriers
-        f.write("\nSubcarrier indices (all tones):\n")
-        if sub_idx.size:
-            f.write(", ".join(str(int(x)) for x in sub_idx) + "\n")
-        else:
-            f.write("N/A\n")
+    try:
+        tx_ant = int(tx_ant)
+    except:
+        tx_ant = "N/A"
+    try:
+        rx_ant = int(rx_ant)
+    except:
+        rx_ant = "N/A"
+
+    w("\n---- Antenna Information ----\n")
+    w(f"TX Antennas (numTx): {tx_ant}    MAC: {tx_primary}\n")
+    w(f"RX Antennas (numRx): {rx_ant}    MAC: {rx_primary}\n")
+
+    # ---------- NEW: CSI matrix info ----------
+    w("\n---- CSI Matrix ----\n")
+    w(
+        f"CSI matrix shape (frames x tones): {Amp.shape[0]} x {Amp.shape[1]}\n"
+    )
+
+    # first few rows of data (amplitude)
+    preview_rows = min(5, Amp.shape[0])
+    w(f"\nFirst {preview_rows} rows of amplitude matrix:\n")
+    # One %-format call per row instead of an f-string per value.
+    row_fmt = ", ".join(["%.4f"] * Amp.shape[1])
+    for i, row in enumerate(Amp[:preview_rows].tolist()):
+        w(f"Row {i}: {row_fmt % tuple(row)}\n")
+
+    # value of all subcarriers
+    w("\nSubcarrier indices (all tones):\n")
+    if sub_idx.size:
+        w(", ".join(map(str, sub_idx.tolist())) + "\n")
+    else:
+        w("N/A\n")
 
-        f.write("=========================================\n")
+    w("=========================================\n")
 
+    with open(summary_path, "w") as f:
+        f.write("".join(buf))
 
     print(f"[+] Saved CSI summary report → {summary_path}")
+
+    if heat_job is not None:
+        heat_job.result()
+        save_pool.shutdown()
+        print(f"[+] Saved plot: {heat_path}")
     print("\nDone.\n")
 
 
@@ -496,6 +524,9 @@ def main():
         analyze_csi(path)
     except Exception as e:
         try:
+            import tkinter as tk
+            from tkinter import messagebox
+
             root = tk.Tk()
             root.withdraw()
             messagebox.showerror("Error", f"Failed to parse CSI file:\n{e}")
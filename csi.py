@@ -15,63 +15,10 @@ import sys
 import os
 
 import numpy as np
-import matplotlib.pyplot as plt
-
-import tkinter as tk
-from tkinter import filedialog, messagebox
 
 from picoscenes import Picoscenes
 
-
-# ----------------- helpers ----------------- #
-
-def pick_file():
-    root = tk.Tk()
-    root.withdraw()
-    root.update()
-    path = filedialog.askopenfilename(
-        title="Select PicoScenes .csi file",
-        filetypes=[("PicoScenes CSI", "*.csi"), ("All files", "*.*")]
-    )
-    root.destroy()
-    if not path:
-        raise SystemExit("No file selected.")
-    return path
-
-
-def mac_to_str(field):
-    """
-    Convert a 6-byte address (list/ndarray/etc.) to 'AA:BB:CC:DD:EE:FF'.
-    Returns None if it cannot be interpreted as a MAC.
-    """
-    if field is None:
-        return None
-    try:
-        arr = np.array(field, dtype=np.uint8).flatten()
-    except Exception:
-        return None
-
-    if arr.size < 6:
-        return None
-
-    vals = [int(x) & 0xFF for x in arr[:6]]
-    return ":".join(f"{b:02X}" for b in vals)
-
-
-def get_timestamp(rx_basic):
-    """
-    Return one timestamp in microseconds from RxSBasic dict.
-    Tries several key spellings (Timestamp/SystemTime).
-    """
-    if not isinstance(rx_basic, dict):
-        return None
-
-    for key in ("Timestamp", "timestamp", "SystemTime", "systemTime"):
-        if key in rx_basic:
-            arr = np.array(rx_basic[key]).flatten()
-            if arr.size:
-                return int(arr[0])
-    return None
+from _csi_common import pick_file, u64_to_mac, to_soa, subcarrier_index
 
 
 # ----------------- main analysis ----------------- #
@@ -83,74 +30,49 @@ def analyze_csi(path):
     ps = Picoscenes(path)
     frames = ps.raw        # list[dict], ALL frames
 
-    # CSI-bearing frames only (for CSI stats)
-    csi_frames = [f for f in frames if "CSI" in f]
-    num_csi = len(csi_frames)
+    # ---------- single pass over ALL frames ----------
+    soa = to_soa(frames)
+    num_frames = len(frames)
+    csi_blocks = soa["csi_blocks"]
+    timestamps = soa["ts_us"]
+    num_csi = int(soa["has_csi"].sum())
 
     if num_csi == 0:
         print("No frames with 'CSI' field found in this file.")
         return
 
     # ---------- MAC extraction: StandardHeader.Addr1/2/3 over ALL frames ----------
-    all_macs = set()
     tx_primary = None
     rx_primary = None
 
-    for f in frames:
-        sh = f.get("StandardHeader") or f.get("standardHeader")
-        if not isinstance(sh, dict):
-            continue
-
-        # Try both capitalizations for the fields
-        A1 = sh.get("Addr1") or sh.get("addr1")   # Receiver
-        A2 = sh.get("Addr2") or sh.get("addr2")   # Transmitter
-        A3 = sh.get("Addr3") or sh.get("addr3")   # BSSID / routing address
-
-        ADDRS = [A1, A2, A3]
-
-        # Convert and filter zeros/broadcast for unique MACs
-        for addr in ADDRS:
-            mac = mac_to_str(addr)
-            if mac is None:
-                continue
-            if mac in ("00:00:00:00:00:00", "FF:FF:FF:FF:FF:FF"):
-                continue
-            all_macs.add(mac)
-
-        # Find FIRST non-zero, non-broadcast TX/RX pair
-        if tx_primary is None and A1 is not None and A2 is not None:
-            rx_mac = mac_to_str(A1)
-            tx_mac = mac_to_str(A2)
-
-            if (
-                rx_mac not in (None, "00:00:00:00:00:00", "FF:FF:FF:FF:FF:FF")
-                and tx_mac not in (None, "00:00:00:00:00:00", "FF:FF:FF:FF:FF:FF")
-            ):
-                tx_primary, rx_primary = tx_mac, rx_mac
+    keys = soa["addr_keys"]                           # (F, 3)
+    valid = soa["addr_valid"]
+    all_macs = {u64_to_mac(k) for k in np.unique(keys[valid])}
 
-    # ---------- timestamps & CSI rate (only CSI frames) ----------
-    timestamps = []
-    for f in csi_frames:
-        rx_basic = f.get("RxSBasic") or f.get("rxSBasic")
-        ts = get_timestamp(rx_basic)
-        if ts is not None:
-            timestamps.append(ts)
+    # first non-broadcast TX/RX pair as "primary"
+    pair = valid[:, 0] & valid[:, 1]
+    if pair.any():
+        i = int(np.argmax(pair))
+        rx_primary = u64_to_mac(keys[i, 0])
+        tx_primary = u64_to_mac(keys[i, 1])
 
+    # ---------- timestamps & CSI rate (only CSI frames) ----------
     time_span_sec = None
     csi_rate = None
-    if len(timestamps) >= 2:
-        t_min = min(timestamps)
-        t_max = max(timestamps)
+    if timestamps.size >= 2:
+        t_min = timestamps.min()
+        t_max = timestamps.max()
         time_span_sec = (t_max - t_min) / 1e6   # µs → seconds
         if time_span_sec > 0:
             csi_rate = num_csi / time_span_sec
 
     # ---------- subcarriers ----------
-    csi_block = csi_frames[0]["CSI"]
+    csi_block = csi_blocks[0]
     num_tones = csi_block.get("NumTones") or csi_block.get("numTones")
-    sub_idx = np.array(
-        csi_block.get("SubcarrierIndex") or csi_block.get("subcarrierIndex") or []
-    ).flatten()
+    raw_idx = csi_block.get("SubcarrierIndex")
+    if raw_idx is None:
+        raw_idx = csi_block.get("subcarrierIndex")
+    sub_idx = subcarrier_index(raw_idx)
     if sub_idx.size:
         num_sub = sub_idx.size
     else:
@@ -158,7 +80,7 @@ def analyze_csi(path):
 
     # ---------- print summary ----------
     print("====== CSI FILE SUMMARY (Python) ======")
-    print(f"Total frames parsed      : {len(frames)}")
+    print(f"Total frames parsed      : {num_frames}")
     print(f"Frames with CSI          : {num_csi}")
     if time_span_sec is not None:
         print(f"Capture time span        : {time_span_sec:.3f} s")
@@ -190,10 +112,11 @@ def analyze_csi(path):
     print("\nDone.\n")
 
     # ---------- optional: CSI timeline plot ----------
-    if timestamps:
-        ts_sorted = sorted(timestamps)
-        t0 = ts_sorted[0]
-        t_rel = [(t - t0) / 1e6 for t in ts_sorted]   # seconds
+    if timestamps.size:
+        ts_sorted = np.sort(timestamps)
+        t_rel = (ts_sorted - ts_sorted[0]) / 1e6   # seconds
+        import matplotlib.pyplot as plt  # deferred: only needed for the timeline
+
         plt.figure(figsize=(8, 4))
         plt.plot(t_rel, range(1, len(t_rel) + 1))
         plt.xlabel("Time since first CSI frame (s)")
@@ -222,6 +145,9 @@ def main():
         analyze_csi(path)
     except Exception as e:
         try:
+            import tkinter as tk
+            from tkinter import messagebox
+
             root = tk.Tk()
             root.withdraw()
             messagebox.showerror("Error", f"Failed to parse CSI file:\n{e}")
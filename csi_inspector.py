@@ -26,6 +26,7 @@ Usage:
   python csi_inspector_merged.py /path/to/file.csi
   python csi_inspector_merged.py /path/to/file.csi --tx-mac 24:4B:FE:BE:FF:DC
   python csi_inspector_merged.py /path/to/file.csi --no-tx-filter
+  python csi_inspector_merged.py /path/to/file.csi --cache
 
 Outputs (inside output folder named after the .csi file):
   - timestamps.txt
@@ -50,14 +51,28 @@ Notes:
   - Addr1 is Receiver (RA), Addr2 is Transmitter (TA) in 802.11 StandardHeader.
   - “Primary RX” is selected as the unicast receiver with the most CSI frames after TX filtering (when enabled).
   - “Primary TX/RX” (from complete_csi.py behavior) is the first non-broadcast TX/RX pair observed in frames.
+  - --cache keeps the parsed frame arrays in <file>.soa.npz next to the .csi; later runs on the
+    unchanged file (same size and mtime) load it instead of re-parsing with PicoScenes.
 """
 
 import sys
 import os
 import argparse
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
 from collections import Counter
 import numpy as np
+
+try:
+    from numba import njit, prange  # optional: fused unwrap + mean kernel
+except ImportError:
+    njit = None
+import matplotlib
+matplotlib.use("Agg")  # plots are only saved to PNG; skip GUI backend setup
 import matplotlib.pyplot as plt
+from matplotlib.colorbar import make_axes
+from matplotlib.colors import Normalize
 
 # Optional GUI file picker
 try:
@@ -69,6 +84,11 @@ except Exception:
 
 from picoscenes import Picoscenes
 
+# MACs are packed into one uint64 each: comparisons, np.unique and Counter
+# keys work on words, and strings are only built for the few unique
+# addresses that get reported.
+from _csi_common import MAC_BROADCAST_KEY, macs_to_u64, u64_to_mac
+
 
 # -----------------------------
 # Defaults
@@ -150,65 +170,42 @@ def to_float_safe(x):
 # -------------------------------------------------------------
 #                   MAC UTILITIES
 # -------------------------------------------------------------
-def mac_to_str(field):
-    """
-    Convert a 6-byte address (list/ndarray/etc.) to 'AA:BB:CC:DD:EE:FF'.
-    Returns None if it cannot be interpreted as a MAC.
-    """
-    if field is None:
-        return None
-    try:
-        arr = np.array(field, dtype=np.uint8).flatten()
-    except Exception:
-        return None
-
-    if arr.size < 6:
-        return None
-
-    vals = [int(x) & 0xFF for x in arr[:6]]
-    return ":".join(f"{b:02X}" for b in vals)
-
-
 def norm_mac(mac):
     if mac is None:
         return None
     return mac.strip().upper()
 
 
-def is_valid_unicast(mac):
-    """
-    Returns True for a valid unicast MAC:
-      - Not all-zero, not broadcast
-      - Multicast bit must be 0
-    """
-    if mac in (None, "00:00:00:00:00:00", "FF:FF:FF:FF:FF:FF"):
-        return False
-    try:
-        first_octet = int(mac.split(":")[0], 16)
-    except Exception:
-        return False
-    return (first_octet & 1) == 0
-
-
 # -------------------------------------------------------------
 #                   TIMESTAMP EXTRACTOR
 # -------------------------------------------------------------
+TS_KEYS = ("Timestamp", "timestamp", "SystemTime", "systemTime")
+
+
 def get_timestamp_us(rx_basic):
     """
     Return one timestamp in microseconds from RxSBasic dict.
-    Tries several key spellings (Timestamp/SystemTime).
+    Tries several key spellings (Timestamp/SystemTime). Scalars and flat
+    sequences are read directly; only odd shapes go through NumPy.
     """
     if not isinstance(rx_basic, dict):
         return None
 
-    for key in ("Timestamp", "timestamp", "SystemTime", "systemTime"):
-        if key in rx_basic:
-            arr = np.array(rx_basic[key]).flatten()
-            if arr.size:
-                try:
-                    return int(arr[0])
-                except Exception:
-                    return None
+    for key in TS_KEYS:
+        v = rx_basic.get(key)
+        if v is None:
+            continue
+        try:
+            if hasattr(v, "__len__"):
+                if len(v) == 0:
+                    continue
+                v = v[0]
+            return int(v)
+        except Exception:
+            try:
+                return int(np.asarray(v).ravel()[0])
+            except Exception:
+                return None
     return None
 
 
@@ -219,26 +216,328 @@ def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
 
-def save_plot(fig, folder, name):
+def _write_png(path, data):
+    """Write one encoded PNG; runs on the save pool."""
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def save_plot(fig, folder, name, ax=None, pool=None):
+    """
+    Save fig as folder/name. With `ax`, the figure is kept for reuse and only
+    that axes is cleared; otherwise the figure is closed.
+    With `pool`, the figure is rendered and encoded here (same tight-bbox
+    PNG as a direct savefig) and only the file write runs on the pool. The
+    future is returned and the caller reports the path once result()
+    succeeds.
+    """
     ensure_dir(folder)
     out_path = os.path.join(folder, name)
-    fig.savefig(out_path, dpi=200, bbox_inches="tight")
-    plt.close(fig)
-    print(f"[+] Saved plot: {out_path}")
-    return out_path
+    if pool is None:
+        fig.savefig(out_path, dpi=200, bbox_inches="tight")
+        print(f"[+] Saved plot: {out_path}")
+        done = out_path
+    else:
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=200, bbox_inches="tight")
+        done = pool.submit(_write_png, out_path, buf.getvalue())
+    if ax is None:
+        plt.close(fig)
+    else:
+        ax.clear()
+    return done
+
+
+LINE_PLOT_MAX_BUCKETS = 4000
+
+
+def minmax_decimate(y, x=None, target=LINE_PLOT_MAX_BUCKETS):
+    """
+    Shrink a long 1-D series for plotting: split it into `target` buckets
+    and keep each bucket's min and max sample (in original order), so the
+    drawn envelope matches the full series at PNG resolution. Short series
+    are returned unchanged. Returns (x, y); x defaults to the sample index.
+    """
+    y = np.asarray(y)
+    n = y.size
+    if n <= 2 * target:
+        return (np.arange(n) if x is None else x), y
+
+    bucket = n // target
+    m = bucket * target
+    yb = y[:m].reshape(target, bucket)
+    i_min = yb.argmin(axis=1)
+    i_max = yb.argmax(axis=1)
+    base = np.arange(target) * bucket
+    idx = np.empty(2 * target + 1, dtype=np.intp)
+    idx[0:-1:2] = base + np.minimum(i_min, i_max)
+    idx[1:-1:2] = base + np.maximum(i_min, i_max)
+    idx[-1] = n - 1                         # keep the last sample
+    return (idx if x is None else np.asarray(x)[idx]), y[idx]
+
+
+HEATMAP_MAX_ROWS = 1000
+
+
+def downsample_rows(M, target=HEATMAP_MAX_ROWS):
+    """
+    Block-average the rows of an (N, K) matrix down to `target` rows so
+    imshow never rasterises more rows than the PNG can show. Trailing
+    rows that do not fill a whole block are dropped.
+    """
+    n = M.shape[0]
+    if n <= target:
+        return M
+    block = n // target
+    return M[:block * target].reshape(target, block, M.shape[1]).mean(axis=1)
+
+
+def unwrap_rows(P):
+    """
+    np.unwrap(P, axis=1) kept in P's dtype (float32 here): count the 2*pi
+    wraps between neighbouring tones, accumulate them along the row and
+    subtract once. Works on integer wrap counts, so no rounding drift
+    builds up along the row.
+    """
+    k = np.diff(P, axis=1)
+    k *= 0.5 / np.pi
+    np.round(k, out=k)
+    np.cumsum(k, axis=1, out=k)
+    out = P.copy()
+    out[:, 1:] -= (2 * np.pi) * k
+    return out
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _unwrap_row_means_jit(P):
+        n, k = P.shape
+        out = np.empty(n)
+        inv_2pi = 0.5 / np.pi
+        for i in prange(n):
+            prev = P[i, 0]
+            s = float(prev)
+            wraps = 0.0
+            for j in range(1, k):
+                x = P[i, j]
+                wraps += np.rint((x - prev) * inv_2pi)
+                s += x - 2 * np.pi * wraps
+                prev = x
+            out[i] = s / k
+        return out
+
+
+def unwrap_row_means(P):
+    """
+    Per-row mean of unwrap_rows(P). With numba the wrap count and the row
+    sum run in one parallel pass, without the (N, K) unwrapped copy.
+    """
+    if njit is not None:
+        return _unwrap_row_means_jit(np.ascontiguousarray(P)).astype(P.dtype)
+    return unwrap_rows(P).mean(axis=1)
+
+
+def row_moments(M):
+    """
+    Per-row mean and std of an (N, K) matrix from one sum and one
+    sum-of-squares sweep (float64 accumulators), instead of separate
+    mean() and std() passes.
+    """
+    k = M.shape[1]
+    mean = M.sum(axis=1, dtype=np.float64) / k
+    sq = np.einsum("ij,ij->i", M, M, dtype=np.float64) / k
+    std = np.sqrt(np.maximum(sq - mean * mean, 0.0))
+    return mean.astype(M.dtype), std.astype(M.dtype)
 
 
 def write_lines(path, lines):
     ensure_dir(os.path.dirname(path))
+    text = "".join(line + "\n" for line in lines)
     with open(path, "w", encoding="utf-8") as f:
-        for line in lines:
-            f.write(line + "\n")
+        f.write(text)
+
+
+# -------------------------------------------------------------
+#                   FRAME EXTRACTION (SoA) + CACHE
+# -------------------------------------------------------------
+# CSI-block keys read by the metadata / frequency-mapping code.
+CSI_META_KEYS = (
+    "SubcarrierIndex", "subcarrierIndex", "SubcarrierBandwidth", "subcarrierBandwidth",
+    "CarrierFreq", "CarrierFreq2", "carrierFreq", "carrierFreq2", "CBW", "cbw",
+    "SamplingRate", "samplingRate", "NumTones", "numTones",
+    "NumTx", "numTx", "NumRx", "numRx", "IsMerged", "isMerged",
+)
+
+SOA_ARRAYS = ("addrs", "present", "csi_idx", "csi_ts", "csi_ts_ok", "mag_n", "ph_n", "amp", "phase")
+
+
+def extract_soa(frames, with_matrices=False):
+    """
+    One walk over PicoScenes frames into plain arrays (struct-of-arrays):
+      addrs (F, 3, 6) / present (F, 3)    Addr1/2/3 bytes of every frame
+      csi_idx, csi_ts, csi_ts_ok (C,)     frame index + timestamp per CSI frame
+      mag_n, ph_n (C,)                    Mag / Phase length per CSI frame
+      meta {row: dict}                    CSI metadata of CSI row 0 and of the
+                                          first CSI frame of each TX (Addr2)
+      blocks                              the CSI dicts, read by fill_matrices
+    With `with_matrices` (only for --cache) it also fills
+      amp, phase (C, W) float32           rows padded to the widest frame
+                                          (filled only when Mag/Phase agree)
+    so a cached run needs no frames at all.
+    """
+    total_frames = len(frames)
+    addrs = np.zeros((total_frames, 3, 6), dtype=np.uint8)
+    present = np.zeros((total_frames, 3), dtype=bool)
+    csi_idx = np.empty(total_frames, dtype=np.intp)
+    csi_ts = np.zeros(total_frames, dtype=np.int64)
+    csi_ts_ok = np.zeros(total_frames, dtype=bool)
+    mag_n = np.empty(total_frames, dtype=np.int64)
+    ph_n = np.empty(total_frames, dtype=np.int64)
+    blocks = []
+    meta = {}
+    seen_tx = set()
+
+    # Key spellings are fixed pairs probed inline; get_dict_any/get_any stay
+    # for the one-off metadata lookups.
+    addr_keys = (("Addr1", "addr1"), ("Addr2", "addr2"), ("Addr3", "addr3"))
+
+    for i, f in enumerate(frames):
+        sh = f.get("StandardHeader") or f.get("standardHeader")
+        if isinstance(sh, dict):
+            # Addr1 = receiver, Addr2 = transmitter, Addr3 = BSSID / routing
+            for j, (key, key_lc) in enumerate(addr_keys):
+                addr = sh.get(key)
+                if addr is None:
+                    addr = sh.get(key_lc)
+                if addr is None:
+                    continue
+                try:
+                    arr = np.asarray(addr, dtype=np.uint8).ravel()
+                except Exception:
+                    continue
+                if arr.size >= 6:
+                    addrs[i, j] = arr[:6]
+                    present[i, j] = True
+
+        # CSI-bearing frames only (as in both original scripts)
+        c = f.get("CSI")
+        if not isinstance(c, dict):
+            continue
+        n = len(blocks)
+        csi_idx[n] = i
+        blocks.append(c)
+
+        ts = get_timestamp_us(f.get("RxSBasic") or f.get("rxSBasic"))
+        if ts is not None:
+            csi_ts[n] = ts
+            csi_ts_ok[n] = True
+
+        # lengths only; the values are read once, straight into the matrices
+        mag_n[n] = np.size(c.get("Mag"))
+        ph_n[n] = np.size(c.get("Phase"))
+
+        # Metadata comes from the first *used* CSI frame, which is either CSI
+        # row 0 or the first frame of the target TX.
+        tx = addrs[i, 1].tobytes() if present[i, 1] else None
+        if n == 0 or tx not in seen_tx:
+            seen_tx.add(tx)
+            meta[n] = {k: c[k] for k in CSI_META_KEYS if k in c}
+
+    num_csi = len(blocks)
+    soa = {
+        "total_frames": total_frames,
+        "addrs": addrs,
+        "present": present,
+        "csi_idx": csi_idx[:num_csi],
+        "csi_ts": csi_ts[:num_csi],
+        "csi_ts_ok": csi_ts_ok[:num_csi],
+        "mag_n": mag_n[:num_csi],
+        "ph_n": ph_n[:num_csi],
+        "meta": meta,
+        "blocks": blocks,
+    }
+
+    if with_matrices:
+        same = soa["mag_n"] == soa["ph_n"]
+        width = int(soa["mag_n"][same].max()) if same.any() else 0
+        amp = np.zeros((num_csi, width), dtype=np.float32)
+        phase = np.zeros((num_csi, width), dtype=np.float32)
+        for n in np.flatnonzero(same):
+            k = soa["mag_n"][n]
+            amp[n, :k] = np.asarray(blocks[n].get("Mag"), dtype=np.float32).ravel()
+            phase[n, :k] = np.asarray(blocks[n].get("Phase"), dtype=np.float32).ravel()
+        soa["amp"] = amp
+        soa["phase"] = phase
+
+    return soa
+
+
+def fill_matrices(blocks, rows, K):
+    """
+    (len(rows), K) float32 Amp / Phase, each row written straight from
+    its CSI block (rows are pre-selected to have K tones).
+    """
+    Amp = np.empty((len(rows), K), dtype=np.float32)
+    Phase = np.empty((len(rows), K), dtype=np.float32)
+    for r, n in enumerate(rows):
+        c = blocks[n]
+        Amp[r] = np.asarray(c.get("Mag"), dtype=np.float32).ravel()
+        Phase[r] = np.asarray(c.get("Phase"), dtype=np.float32).ravel()
+    return Amp, Phase
+
+
+def soa_cache_path(path):
+    return os.path.splitext(path)[0] + ".soa.npz"
+
+
+def _src_stamp(path):
+    st = os.stat(path)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def load_soa_cache(cache_path, src_path):
+    """Return the cached SoA for src_path, or None if missing/stale/unreadable."""
+    if not os.path.isfile(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as z:
+            if not np.array_equal(z["src_stamp"], _src_stamp(src_path)):
+                return None
+            soa = {k: z[k] for k in SOA_ARRAYS}
+            soa["total_frames"] = int(z["total_frames"])
+            soa["meta"] = {int(k): v for k, v in json.loads(str(z["meta_json"])).items()}
+    except (OSError, KeyError, ValueError):
+        return None
+    return soa
+
+
+def save_soa_cache(cache_path, src_path, soa):
+    try:
+        meta_json = json.dumps({
+            str(n): {k: np.asarray(v).tolist() for k, v in d.items()}
+            for n, d in soa["meta"].items()
+        })
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            np.savez(
+                fh,
+                src_stamp=_src_stamp(src_path),
+                total_frames=np.int64(soa["total_frames"]),
+                meta_json=np.array(meta_json),
+                **{k: soa[k] for k in SOA_ARRAYS},
+            )
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"[!] Could not write frame cache {cache_path}: {e}")
+        return
+    print(f"[+] Saved frame cache → {cache_path}")
 
 
 # -------------------------------------------------------------
 #                   MAIN ANALYSIS
 # -------------------------------------------------------------
-def analyze_csi(path, target_tx_mac, use_tx_filter=True):
+def analyze_csi(path, target_tx_mac, use_tx_filter=True, use_cache=False):
     print(f"\nOpening file: {path}")
     print(f"File size: {os.path.getsize(path) / (1024 * 1024):.2f} MB\n")
 
@@ -246,73 +545,75 @@ def analyze_csi(path, target_tx_mac, use_tx_filter=True):
     out_dir = os.path.splitext(os.path.basename(path))[0]
     ensure_dir(out_dir)
 
-    # Load PicoScenes file
-    ps = Picoscenes(path)
-    frames = ps.raw
-    total_frames = len(frames)
+    # Load PicoScenes file (or its SoA cache) into flat arrays
+    cache_path = soa_cache_path(path)
+    soa = load_soa_cache(cache_path, path) if use_cache else None
+    if soa is not None:
+        print(f"[+] Loaded frame cache ← {cache_path}")
+    else:
+        soa = extract_soa(Picoscenes(path).raw, with_matrices=use_cache)
+        if use_cache:
+            save_soa_cache(cache_path, path, soa)
+            del soa["amp"], soa["phase"]   # frames are at hand: fill (N, K) directly
+
+    total_frames = soa["total_frames"]
+    addrs = soa["addrs"]
+    present = soa["present"]
+    csi_idx = soa["csi_idx"]
+    csi_ts = soa["csi_ts"]
+    csi_ts_ok = soa["csi_ts_ok"]
+    num_csi_all = int(csi_idx.size)
+
+    TARGET = norm_mac(target_tx_mac) if target_tx_mac else None
+    target_bytes = None
+    if use_tx_filter and TARGET:
+        try:
+            target_bytes = bytes.fromhex(TARGET.replace(":", ""))
+        except ValueError:
+            pass
 
-    # CSI-bearing frames only (as in both original scripts)
-    csi_frames_all = [f for f in frames if isinstance(f.get("CSI"), dict)]
-    if not csi_frames_all:
+    if num_csi_all == 0:
         print("No CSI frames found (no frames containing a 'CSI' dict).")
         return
 
     # ---------------------------------------------------------
     #   MAC EXTRACTION OVER ALL FRAMES (complete_csi.py behavior)
     # ---------------------------------------------------------
-    all_macs = set()
     tx_primary_firstpair = None
     rx_primary_firstpair = None
 
-    for f in frames:
-        sh = get_dict_any(f, ["StandardHeader", "standardHeader"])
-        if not isinstance(sh, dict):
-            continue
-
-        A1 = sh.get("Addr1") or sh.get("addr1")   # receiver
-        A2 = sh.get("Addr2") or sh.get("addr2")   # transmitter
-        A3 = sh.get("Addr3") or sh.get("addr3")   # BSSID / routing
-
-        for addr in (A1, A2, A3):
-            mac = mac_to_str(addr)
-            if mac is None:
-                continue
-            if mac in ("00:00:00:00:00:00", "FF:FF:FF:FF:FF:FF"):
-                continue
-            all_macs.add(norm_mac(mac))
-
-        # first non-broadcast TX/RX pair as "primary" (original complete_csi.py logic)
-        if tx_primary_firstpair is None and A1 is not None and A2 is not None:
-            rx_mac = norm_mac(mac_to_str(A1))
-            tx_mac = norm_mac(mac_to_str(A2))
-            if (
-                rx_mac not in (None, "00:00:00:00:00:00", "FF:FF:FF:FF:FF:FF")
-                and tx_mac not in (None, "00:00:00:00:00:00", "FF:FF:FF:FF:FF:FF")
-            ):
-                tx_primary_firstpair, rx_primary_firstpair = tx_mac, rx_mac
+    mac_keys = macs_to_u64(addrs)            # (F, 3) uint64
+    valid = present & (mac_keys != 0) & (mac_keys != MAC_BROADCAST_KEY)
+    all_macs = {u64_to_mac(k) for k in np.unique(mac_keys[valid])}
+
+    # first non-broadcast TX/RX pair as "primary" (original complete_csi.py logic)
+    pair = valid[:, 0] & valid[:, 1]
+    if pair.any():
+        i = int(np.argmax(pair))
+        rx_primary_firstpair = u64_to_mac(mac_keys[i, 0])
+        tx_primary_firstpair = u64_to_mac(mac_keys[i, 1])
+
+    # CSI frames whose Addr2 is the target TX, and their unicast RX
+    # (multicast bit clear, not all-zero) counted in frame order.
+    tx_match = np.zeros(num_csi_all, dtype=bool)
+    rx_counter = Counter()
+    if target_bytes is not None and len(target_bytes) == 6:
+        target_key = int.from_bytes(target_bytes, "little")
+        tx_match = present[csi_idx, 1] & (mac_keys[csi_idx, 1] == target_key)
+        rx_keys = mac_keys[csi_idx[tx_match & present[csi_idx, 0]], 0]
+        rx_keys = rx_keys[((rx_keys & 1) == 0) & (rx_keys != 0)]
+        rx_counter.update({u64_to_mac(k): c for k, c in Counter(rx_keys.tolist()).items()})
 
     # ---------------------------------------------------------
     #   FILTER CSI BY TARGET TX (csi_metadata.py behavior)
     # ---------------------------------------------------------
-    TARGET = norm_mac(target_tx_mac) if target_tx_mac else None
-    csi_frames_used = []
-    rx_list_unicast = []
+    # `used` indexes the CSI frames (rows of csi_idx / csi_ts) kept for analysis.
+    used = None
 
     if use_tx_filter and TARGET:
         # Determine if target is in observed MACs (csi_metadata.py behavior)
         if TARGET in all_macs:
-            for f in csi_frames_all:
-                sh = get_dict_any(f, ["StandardHeader", "standardHeader"])
-                if not isinstance(sh, dict):
-                    continue
-
-                tx = norm_mac(mac_to_str(sh.get("Addr2") or sh.get("addr2")))
-                rx = norm_mac(mac_to_str(sh.get("Addr1") or sh.get("addr1")))
-
-                if tx == TARGET:
-                    csi_frames_used.append(f)
-                    if is_valid_unicast(rx):
-                        rx_list_unicast.append(rx)
+            used = np.flatnonzero(tx_match)
 
             print("==========================================")
             print(" Target TX filtering ENABLED")
@@ -320,24 +621,24 @@ def analyze_csi(path, target_tx_mac, use_tx_filter=True):
             print(f"Forced TX MAC : {TARGET}\n")
         else:
             # If target not found, use all CSI frames (original csi_metadata.py behavior)
-            csi_frames_used = csi_frames_all
+            rx_counter.clear()
             print("Target TX not found in observed MACs; using all CSI frames.\n")
     else:
-        csi_frames_used = csi_frames_all
         if use_tx_filter:
             print("TX filtering requested but no TARGET TX MAC provided; using all CSI frames.\n")
         else:
             print("Target TX filtering DISABLED; using all CSI frames.\n")
 
-    if not csi_frames_used:
+    if used is None:
+        used = np.arange(num_csi_all)
+
+    if used.size == 0:
         print("No CSI frames after TX filtering.")
         return
 
-    num_csi_used = len(csi_frames_used)
-    num_csi_all = len(csi_frames_all)
+    num_csi_used = int(used.size)
 
     # RX selection: most CSI, unicast only (csi_metadata.py behavior)
-    rx_counter = Counter(rx_list_unicast)
     rx_primary_bycount = rx_counter.most_common(1)[0][0] if rx_counter else None
 
     print(f"Total frames parsed      : {total_frames}")
@@ -356,31 +657,38 @@ def analyze_csi(path, target_tx_mac, use_tx_filter=True):
     # ---------------------------------------------------------
     #   TIMESTAMPS & RATES (complete_csi.py behavior; on used frames)
     # ---------------------------------------------------------
-    timestamps = []
-    for f in csi_frames_used:
-        rx_basic = get_dict_any(f, ["RxSBasic", "rxSBasic"])
-        ts = get_timestamp_us(rx_basic)
-        if ts is not None:
-            timestamps.append(ts)
+    # All 8x4 line plots share one Figure/Axes (cleared by save_plot);
+    # the heatmaps use their own 8x5 figures. PNG encodes go to save_pool.
+    save_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    plot_jobs = []
+    fig, ax = plt.subplots(figsize=(8, 4))
+
+    timestamps = csi_ts[used][csi_ts_ok[used]]
 
     timestamps_path = os.path.join(out_dir, "timestamps.txt")
-    write_lines(timestamps_path, [str(t) for t in timestamps])
+    write_lines(timestamps_path, map(str, timestamps.tolist()))
     print(f"[+] Saved timestamp list → {timestamps_path}")
 
+    # Capture timestamps are almost always already in order; only sort
+    # when a monotonicity check fails.
+    ts_sorted = timestamps
+    if not (timestamps[1:] >= timestamps[:-1]).all():
+        ts_sorted = np.sort(timestamps)
+
     time_span_sec = None
     csi_rate = None
     fps = None
     dt_stats = {}
 
-    if len(timestamps) >= 2:
-        t_min = min(timestamps)
-        t_max = max(timestamps)
+    if timestamps.size >= 2:
+        t_min = ts_sorted[0]
+        t_max = ts_sorted[-1]
         time_span_sec = (t_max - t_min) / 1e6  # microseconds → seconds
         if time_span_sec and time_span_sec > 0:
             csi_rate = num_csi_used / time_span_sec
 
-        ts_sec = np.array(timestamps, dtype=np.float64) / 1e6
-        dt = np.diff(np.sort(ts_sec))
+        ts_sec = ts_sorted / 1e6
+        dt = np.diff(ts_sec)
         if dt.size > 0 and np.mean(dt) > 0:
             fps = 1.0 / np.mean(dt)
 
@@ -395,51 +703,47 @@ def analyze_csi(path, target_tx_mac, use_tx_filter=True):
             }
 
             # Inter-arrival plot (ADDED)
-            fig = plt.figure(figsize=(8, 4))
-            plt.plot(dt)
-            plt.xlabel("Interval Index")
-            plt.ylabel("Inter-arrival dt (s)")
-            plt.title("CSI Timestamp Inter-arrival (dt)")
-            plt.grid(True)
-            save_plot(fig, out_dir, "inter_arrival_dt.png")
+            ax.plot(*minmax_decimate(dt))
+            ax.set_xlabel("Interval Index")
+            ax.set_ylabel("Inter-arrival dt (s)")
+            ax.set_title("CSI Timestamp Inter-arrival (dt)")
+            ax.grid(True)
+            plot_jobs.append(save_plot(fig, out_dir, "inter_arrival_dt.png", ax=ax, pool=save_pool))
 
     # ---------------------------------------------------------
     #   BUILD AMPLITUDE / PHASE MATRICES (both scripts)
     # ---------------------------------------------------------
-    Amp_list = []
-    Phase_list = []
-    csi_meta = None
-
-    for f in csi_frames_used:
-        c = f.get("CSI")
-        if not isinstance(c, dict):
-            continue
-
-        if csi_meta is None:
-            csi_meta = c  # first CSI block used for metadata
-
-        mag = np.array(c.get("Mag"))
-        ph = np.array(c.get("Phase"))
-
-        if mag.size == 0 or ph.size == 0:
-            continue
-
-        mag = mag.flatten()
-        ph = ph.flatten()
-
-        # Ensure consistent tone count across frames
-        if Amp_list and mag.size != Amp_list[0].size:
-            continue
+    # The first used frame with non-empty Mag and Phase fixes K; used frames
+    # whose Mag and Phase both have K tones become the rows of Amp/Phase.
+    mag_n = soa["mag_n"][used]
+    ph_n = soa["ph_n"][used]
+    nonempty = (mag_n > 0) & (ph_n > 0)
+    if not nonempty.any():
+        raise RuntimeError("No valid CSI Mag/Phase arrays found in frames used.")
+    K = int(mag_n[np.argmax(nonempty)])
+    rows = used[nonempty & (mag_n == K) & (ph_n == K)]
+    N = int(rows.size)
+    if N == 0:
+        raise RuntimeError("No valid CSI Mag/Phase arrays found in frames used.")
 
-        Amp_list.append(mag)
-        Phase_list.append(ph)
+    if "blocks" in soa:
+        Amp, Phase = fill_matrices(soa["blocks"], rows, K)   # shape: (N, K)
+    elif N == num_csi_all and K == soa["amp"].shape[1]:
+        Amp, Phase = soa["amp"], soa["phase"]   # every row kept: no copy
+    else:
+        Amp = soa["amp"][rows, :K]      # shape: (N, K)
+        Phase = soa["phase"][rows, :K]  # shape: (N, K)
+    csi_meta = soa["meta"][int(used[0])]  # first used CSI block's metadata
+    del soa
 
-    if not Amp_list:
-        raise RuntimeError("No valid CSI Mag/Phase arrays found in frames used.")
+    # Per-frame mean/std, one sweep per matrix; reused by the plots and
+    # the frame_stats export.
+    mean_amp_f, std_amp_f = row_moments(Amp)
+    mean_phase_f, std_phase_f = row_moments(Phase)
 
-    Amp = np.vstack(Amp_list)      # shape: (N, K)
-    Phase = np.vstack(Phase_list)  # shape: (N, K)
-    N, K = Amp.shape
+    # Per-subcarrier means, shared by the vs-subcarrier and freq-amp plots
+    amp_mean_col = Amp.mean(axis=0)
+    phase_mean_col = Phase.mean(axis=0)
 
     # Subcarrier indices
     sub_idx = np.array(get_any(csi_meta, ["SubcarrierIndex", "subcarrierIndex"], default=[])).flatten()
@@ -449,96 +753,87 @@ def analyze_csi(path, target_tx_mac, use_tx_filter=True):
     #   PLOTS (unique, conventionally named)
     # ---------------------------------------------------------
     # Amp frame 1
-    fig = plt.figure(figsize=(8, 4))
-    plt.plot(Amp[0]); plt.grid(True)
-    plt.xlabel("Tone / Subcarrier Bin")
-    plt.ylabel("Amplitude")
-    plt.title("CSI Amplitude — Frame 1")
-    save_plot(fig, out_dir, "amp_frame1.png")
+    ax.plot(Amp[0]); ax.grid(True)
+    ax.set_xlabel("Tone / Subcarrier Bin")
+    ax.set_ylabel("Amplitude")
+    ax.set_title("CSI Amplitude — Frame 1")
+    plot_jobs.append(save_plot(fig, out_dir, "amp_frame1.png", ax=ax, pool=save_pool))
 
     # Phase frame 1
-    fig = plt.figure(figsize=(8, 4))
-    plt.plot(Phase[0]); plt.grid(True)
-    plt.xlabel("Tone / Subcarrier Bin")
-    plt.ylabel("Phase (rad)")
-    plt.title("CSI Phase — Frame 1")
-    save_plot(fig, out_dir, "phase_frame1.png")
+    ax.plot(Phase[0]); ax.grid(True)
+    ax.set_xlabel("Tone / Subcarrier Bin")
+    ax.set_ylabel("Phase (rad)")
+    ax.set_title("CSI Phase — Frame 1")
+    plot_jobs.append(save_plot(fig, out_dir, "phase_frame1.png", ax=ax, pool=save_pool))
 
     # Mean amplitude over time
-    mean_amp = Amp.mean(axis=1)
-    fig = plt.figure(figsize=(8, 4))
-    plt.plot(mean_amp); plt.grid(True)
-    plt.xlabel("Frame Index")
-    plt.ylabel("Mean Amplitude")
-    plt.title("Mean CSI Amplitude Over Time")
-    save_plot(fig, out_dir, "amplitude_over_time.png")
+    mean_amp = mean_amp_f
+    ax.plot(*minmax_decimate(mean_amp)); ax.grid(True)
+    ax.set_xlabel("Frame Index")
+    ax.set_ylabel("Mean Amplitude")
+    ax.set_title("Mean CSI Amplitude Over Time")
+    plot_jobs.append(save_plot(fig, out_dir, "amplitude_over_time.png", ax=ax, pool=save_pool))
 
     # Mean phase over time
-    mean_phase = Phase.mean(axis=1)
-    fig = plt.figure(figsize=(8, 4))
-    plt.plot(mean_phase); plt.grid(True)
-    plt.xlabel("Frame Index")
-    plt.ylabel("Mean Phase (rad)")
-    plt.title("Mean CSI Phase Over Time")
-    save_plot(fig, out_dir, "phase_over_time.png")
-
-    # Amplitude heatmap
-    fig = plt.figure(figsize=(8, 5))
-    plt.imshow(Amp, aspect="auto")
-    plt.xlabel("Tone / Subcarrier Bin")
-    plt.ylabel("Frame Index")
-    plt.title("CSI Amplitude Heatmap (Frames × Tones)")
-    plt.colorbar(label="Amplitude")
-    save_plot(fig, out_dir, "amplitude_heatmap.png")
-
-    # Phase heatmap (ADDED, unique plot)
-    fig = plt.figure(figsize=(8, 5))
-    plt.imshow(Phase, aspect="auto")
-    plt.xlabel("Tone / Subcarrier Bin")
-    plt.ylabel("Frame Index")
-    plt.title("CSI Phase Heatmap (Frames × Tones)")
-    plt.colorbar(label="Phase (rad)")
-    save_plot(fig, out_dir, "phase_heatmap.png")
+    mean_phase = mean_phase_f
+    ax.plot(*minmax_decimate(mean_phase)); ax.grid(True)
+    ax.set_xlabel("Frame Index")
+    ax.set_ylabel("Mean Phase (rad)")
+    ax.set_title("Mean CSI Phase Over Time")
+    plot_jobs.append(save_plot(fig, out_dir, "phase_over_time.png", ax=ax, pool=save_pool))
+
+    # Amplitude / phase heatmaps (rows block-averaged; extent keeps the
+    # frame-index axis). Both share one figure and one colorbar axes, carved
+    # out once with make_axes (same geometry as colorbar(ax=...)).
+    hfig, hax = plt.subplots(figsize=(8, 5))
+    cax, cbar_kw = make_axes(hax)
+    for M, cbar_label, title, name in (
+        (Amp, "Amplitude", "CSI Amplitude Heatmap (Frames × Tones)", "amplitude_heatmap.png"),
+        (Phase, "Phase (rad)", "CSI Phase Heatmap (Frames × Tones)", "phase_heatmap.png"),   # (ADDED)
+    ):
+        D = downsample_rows(M)
+        norm = Normalize(vmin=float(D.min()), vmax=float(D.max()))
+        im = hax.imshow(D, norm=norm, aspect="auto", extent=[0, K, N, 0])
+        hax.set_xlabel("Tone / Subcarrier Bin")
+        hax.set_ylabel("Frame Index")
+        hax.set_title(title)
+        hfig.colorbar(im, cax=cax, label=cbar_label, **cbar_kw)
+        plot_jobs.append(save_plot(hfig, out_dir, name, ax=hax, pool=save_pool))
+        cax.clear()
+    plt.close(hfig)
 
     # Mean amplitude vs subcarrier bin (ADDED)
-    fig = plt.figure(figsize=(8, 4))
-    plt.plot(Amp.mean(axis=0)); plt.grid(True)
-    plt.xlabel("Tone / Subcarrier Bin")
-    plt.ylabel("Mean Amplitude")
-    plt.title("Mean CSI Amplitude vs Tone/Subcarrier Bin")
-    save_plot(fig, out_dir, "mean_amplitude_vs_subcarrier.png")
+    ax.plot(amp_mean_col); ax.grid(True)
+    ax.set_xlabel("Tone / Subcarrier Bin")
+    ax.set_ylabel("Mean Amplitude")
+    ax.set_title("Mean CSI Amplitude vs Tone/Subcarrier Bin")
+    plot_jobs.append(save_plot(fig, out_dir, "mean_amplitude_vs_subcarrier.png", ax=ax, pool=save_pool))
 
     # Mean phase vs subcarrier bin (ADDED)
-    fig = plt.figure(figsize=(8, 4))
-    plt.plot(Phase.mean(axis=0)); plt.grid(True)
-    plt.xlabel("Tone / Subcarrier Bin")
-    plt.ylabel("Mean Phase (rad)")
-    plt.title("Mean CSI Phase vs Tone/Subcarrier Bin")
-    save_plot(fig, out_dir, "mean_phase_vs_subcarrier.png")
+    ax.plot(phase_mean_col); ax.grid(True)
+    ax.set_xlabel("Tone / Subcarrier Bin")
+    ax.set_ylabel("Mean Phase (rad)")
+    ax.set_title("Mean CSI Phase vs Tone/Subcarrier Bin")
+    plot_jobs.append(save_plot(fig, out_dir, "mean_phase_vs_subcarrier.png", ax=ax, pool=save_pool))
 
     # Phase unwrapping trend (ADDED)
     # Unwrap along tones, then average per frame.
-    phase_unwrapped = np.unwrap(Phase, axis=1)
-    mean_phase_unwrapped = phase_unwrapped.mean(axis=1)
-    fig = plt.figure(figsize=(8, 4))
-    plt.plot(mean_phase_unwrapped); plt.grid(True)
-    plt.xlabel("Frame Index")
-    plt.ylabel("Mean Unwrapped Phase (rad)")
-    plt.title("Mean CSI Unwrapped Phase Over Time")
-    save_plot(fig, out_dir, "phase_unwrapped_over_time.png")
+    mean_phase_unwrapped = unwrap_row_means(Phase)
+    ax.plot(*minmax_decimate(mean_phase_unwrapped)); ax.grid(True)
+    ax.set_xlabel("Frame Index")
+    ax.set_ylabel("Mean Unwrapped Phase (rad)")
+    ax.set_title("Mean CSI Unwrapped Phase Over Time")
+    plot_jobs.append(save_plot(fig, out_dir, "phase_unwrapped_over_time.png", ax=ax, pool=save_pool))
 
     # Timeline plot (complete_csi.py behavior, based on timestamps)
-    if timestamps:
-        ts_sorted = sorted(timestamps)
-        t0 = ts_sorted[0]
-        t_rel = [(t - t0) / 1e6 for t in ts_sorted]  # seconds
-        fig = plt.figure(figsize=(8, 4))
-        plt.plot(t_rel, range(1, len(t_rel) + 1))
-        plt.xlabel("Time since first CSI frame (s)")
-        plt.ylabel("Cumulative CSI packets")
-        plt.title("CSI Packet Timeline")
-        plt.grid(True)
-        save_plot(fig, out_dir, "timeline.png")
+    if timestamps.size:
+        t_rel = (ts_sorted - ts_sorted[0]) / 1e6  # seconds
+        ax.plot(*minmax_decimate(np.arange(1, len(t_rel) + 1), x=t_rel))
+        ax.set_xlabel("Time since first CSI frame (s)")
+        ax.set_ylabel("Cumulative CSI packets")
+        ax.set_title("CSI Packet Timeline")
+        ax.grid(True)
+        plot_jobs.append(save_plot(fig, out_dir, "timeline.png", ax=ax, pool=save_pool))
 
     # ---------------------------------------------------------
     #   FREQUENCY MAPPING FOR TONES (complete_csi.py behavior)
@@ -578,41 +873,43 @@ def analyze_csi(path, target_tx_mac, use_tx_filter=True):
         print(f"[+] Saved tone frequency map → {freq_map_path}")
 
         # Plot mean amplitude vs frequency offset
-        fig = plt.figure(figsize=(8, 4))
         K_eff = min(Amp.shape[1], freq_offsets.size)
-        plt.plot(freq_offsets[:K_eff], Amp.mean(axis=0)[:K_eff])
-        plt.xlabel("Frequency Offset (Hz)")
-        plt.ylabel("Mean Amplitude")
-        plt.title("Mean CSI Amplitude vs Frequency Offset")
-        plt.grid(True)
-        save_plot(fig, out_dir, "freq_amp_plot.png")
+        ax.plot(freq_offsets[:K_eff], amp_mean_col[:K_eff])
+        ax.set_xlabel("Frequency Offset (Hz)")
+        ax.set_ylabel("Mean Amplitude")
+        ax.set_title("Mean CSI Amplitude vs Frequency Offset")
+        ax.grid(True)
+        plot_jobs.append(save_plot(fig, out_dir, "freq_amp_plot.png", ax=ax, pool=save_pool))
         freq_amp_plot_saved = True
 
     except Exception as e:
         freq_mapping_msg = f"Frequency mapping skipped: {e}"
         print(f"[!] {freq_mapping_msg}")
 
+    plt.close(fig)
+
     # ---------------------------------------------------------
     #   PER-FRAME STATS EXPORT (ADDED)
     # ---------------------------------------------------------
     frame_stats_path = os.path.join(out_dir, "frame_stats.csv")
     # columns: frame_index, mean_amp, std_amp, mean_phase, std_phase, mean_unwrapped_phase
-    mean_amp_f = Amp.mean(axis=1)
-    std_amp_f = Amp.std(axis=1)
-    mean_phase_f = Phase.mean(axis=1)
-    std_phase_f = Phase.std(axis=1)
     mean_unwrap_f = mean_phase_unwrapped
 
     header = "frame_index,mean_amp,std_amp,mean_phase,std_phase,mean_unwrapped_phase"
+    # Stats stay float32 up to here; column_stack widens them once, at write time.
     data = np.column_stack((
         np.arange(N, dtype=int),
-        mean_amp_f.astype(float),
-        std_amp_f.astype(float),
-        mean_phase_f.astype(float),
-        std_phase_f.astype(float),
-        mean_unwrap_f.astype(float),
+        mean_amp_f,
+        std_amp_f,
+        mean_phase_f,
+        std_phase_f,
+        mean_unwrap_f,
     ))
-    np.savetxt(frame_stats_path, data, delimiter=",", header=header, comments="", fmt="%.0f,%.6f,%.6f,%.6f,%.6f,%.6f")
+    # One %-format over all rows (C-level), one write; no per-row savetxt loop.
+    row_fmt = "%d,%.6f,%.6f,%.6f,%.6f,%.6f\n"
+    body = (row_fmt * N) % tuple(data.ravel().tolist())
+    with open(frame_stats_path, "w", encoding="utf-8") as f:
+        f.write(header + "\n" + body)
     print(f"[+] Saved per-frame stats → {frame_stats_path}")
 
     # ---------------------------------------------------------
@@ -767,6 +1064,13 @@ def analyze_csi(path, target_tx_mac, use_tx_filter=True):
         f.write("=========================================\n")
 
     print(f"[+] Saved CSI summary → {summary_path}")
+    # Pending PNG writes: report each one only once it has succeeded; a
+    # failed write raises here instead of being lost on the pool.
+    try:
+        for job in plot_jobs:
+            print(f"[+] Saved plot: {job.result()}")
+    finally:
+        save_pool.shutdown(wait=True)
     print("\nDone.\n")
 
 
@@ -793,6 +1097,11 @@ def main():
         action="store_true",
         help="Disable target TX filtering and use all CSI frames."
     )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse/write parsed frame arrays in <file>.soa.npz next to the .csi to skip re-parsing."
+    )
 
     args = parser.parse_args()
 
@@ -809,7 +1118,7 @@ def main():
     use_tx_filter = not args.no_tx_filter
 
     try:
-        analyze_csi(path, target_tx_mac=args.tx_mac, use_tx_filter=use_tx_filter)
+        analyze_csi(path, target_tx_mac=args.tx_mac, use_tx_filter=use_tx_filter, use_cache=args.cache)
     except Exception as e:
         # GUI error dialog if possible (like complete_csi.py behavior)
         if TK_AVAILABLE:
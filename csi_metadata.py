@@ -6,16 +6,27 @@ csi_metadata.py — Robust CSI Inspector for PicoScenes .csi files
 import sys
 import os
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # plots are only saved to PNG; skip GUI backend setup
 import matplotlib.pyplot as plt
-from collections import Counter
+
+try:
+    from numba import njit  # optional: compiled TX filter
+except ImportError:
+    njit = None
 
 import tkinter as tk
 from tkinter import filedialog
 
 from picoscenes import Picoscenes
 
+from _csi_common import (
+    macs_to_u64, u64_to_mac, get_timestamp, resolve_header_keys, resolve_rx_keys,
+)
+
 
 TARGET_TX_MAC = "24:4B:FE:BE:FF:DC"
+HEATMAP_MAX_ROWS = 2048
 
 
 # -------------------------------------------------------------
@@ -38,43 +49,71 @@ def pick_file():
 # -------------------------------------------------------------
 #                   MAC UTILITIES
 # -------------------------------------------------------------
-def mac_to_str(field):
-    if field is None:
-        return None
-    try:
-        arr = np.array(field, dtype=np.uint8).flatten()
-    except Exception:
-        return None
-    if arr.size < 6:
-        return None
-    return ":".join(f"{int(x) & 0xFF:02X}" for x in arr[:6])
-
-
 def norm_mac(mac):
     if mac is None:
         return None
     return mac.strip().upper()
 
 
-def is_valid_unicast(mac):
-    if mac in (None, "00:00:00:00:00:00", "FF:FF:FF:FF:FF:FF"):
-        return False
-    first_octet = int(mac.split(":")[0], 16)
-    return (first_octet & 1) == 0   # multicast bit must be 0
-
-
-# -------------------------------------------------------------
-#                   TIMESTAMP EXTRACTOR
-# -------------------------------------------------------------
-def get_timestamp(rx_basic):
-    if not isinstance(rx_basic, dict):
-        return None
-    for key in ("Timestamp", "timestamp", "SystemTime", "systemTime"):
-        if key in rx_basic:
-            arr = np.array(rx_basic[key]).flatten()
-            if arr.size:
-                return int(arr[0])
-    return None
+# "00".."FF" as a (256, 2) ASCII table; indexing it with a uint8 address
+# array formats every byte at once.
+HEX_LUT = np.frombuffer(
+    b"".join(b"%02X" % i for i in range(256)), dtype=np.uint8
+).reshape(256, 2)
+
+
+def macs_to_str_array(addrs):
+    """
+    (M, 6) uint8 addresses → (M,) 'S17' byte strings
+    (b'AA:BB:CC:DD:EE:FF'), one LUT gather and one allocation.
+    """
+    out = np.full((addrs.shape[0], 17), ord(":"), dtype=np.uint8)
+    hex_pairs = HEX_LUT[addrs]             # (M, 6, 2)
+    out[:, 0::3] = hex_pairs[..., 0]
+    out[:, 1::3] = hex_pairs[..., 1]
+    return out.view("S17")[:, 0]
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _match_tx_jit(hdrs, present, is_csi, target):
+        n = hdrs.shape[0]
+        mask = np.zeros(n, np.bool_)
+        rx_keys = np.empty(n, np.uint64)
+        n_rx = 0
+        for i in range(n):
+            if not (is_csi[i] and present[i, 1]):
+                continue
+            same = True
+            for b in range(6):
+                if hdrs[i, 1, b] != target[b]:
+                    same = False
+                    break
+            if not same:
+                continue
+            mask[i] = True
+            if present[i, 0] and (hdrs[i, 0, 0] & 1) == 0:
+                key = np.uint64(0)   # macs_to_u64 layout: byte b at bits 8*b
+                for b in range(6):
+                    key |= np.uint64(hdrs[i, 0, b]) << np.uint64(8 * b)
+                if key != 0:
+                    rx_keys[n_rx] = key
+                    n_rx += 1
+        return mask, rx_keys[:n_rx]
+
+
+def match_tx(hdrs, present, is_csi, target):
+    """
+    CSI frames whose Addr2 equals `target` (6 uint8), plus the macs_to_u64 keys
+    of their unicast Addr1 in frame order. Compiled with numba when
+    available, otherwise whole-array NumPy.
+    """
+    if njit is not None:
+        return _match_tx_jit(hdrs, present, is_csi, target)
+    mask = is_csi & present[:, 1] & (hdrs[:, 1] == target).all(axis=1)
+    rx = hdrs[mask & present[:, 0], 0]
+    rx = rx[((rx[:, 0] & 1) == 0) & rx.any(axis=1)]
+    return mask, macs_to_u64(rx)
 
 
 # -------------------------------------------------------------
@@ -83,7 +122,10 @@ def get_timestamp(rx_basic):
 def save_plot(fig, folder, name):
     os.makedirs(folder, exist_ok=True)
     path = os.path.join(folder, name)
-    fig.savefig(path, dpi=200, bbox_inches="tight")
+    # tight_layout runs once; bbox_inches="tight" would render twice. Low
+    # zlib level: these PNGs are plots, encode time matters more than size.
+    fig.tight_layout()
+    fig.savefig(path, dpi=200, pil_kwargs={"compress_level": 1})
     plt.close(fig)
     print(f"[+] Saved plot: {path}")
 
@@ -101,47 +143,55 @@ def analyze_csi(path):
     ps = Picoscenes(path)
     frames = ps.raw
 
+    # PicoScenes uses one key spelling per file: resolve it once instead of
+    # probing both spellings on every frame.
+    SH_KEY, *ADDR_KEYS = resolve_header_keys(frames)
+    RXB_KEY, _ = resolve_rx_keys(frames)
+
     # ---------------------------------------------------------
-    #   COLLECT CSI FRAMES
+    #   EXTRACT ALL MAC ADDRESSES (+ COLLECT CSI FRAMES)
     # ---------------------------------------------------------
-    csi_frames_all = [f for f in frames if isinstance(f.get("CSI"), dict)]
+    # One Python pass stages Addr1/2/3 of every frame into (F, 3, 6) uint8
+    # and flags the CSI frames; MAC strings and the TX filter below work on
+    # these arrays only.
+    hdrs = np.zeros((len(frames), 3, 6), dtype=np.uint8)
+    present = np.zeros((len(frames), 3), dtype=bool)
+    is_csi = np.zeros(len(frames), dtype=bool)
+    for i, f in enumerate(frames):
+        is_csi[i] = isinstance(f.get("CSI"), dict)
+        sh = f.get(SH_KEY)
+        if not isinstance(sh, dict):
+            continue
+        for j, k in enumerate(ADDR_KEYS):
+            field = sh.get(k)
+            if field is None:
+                continue
+            try:
+                arr = np.asarray(field, dtype=np.uint8).ravel()
+            except Exception:
+                continue
+            if arr.size >= 6:
+                hdrs[i, j] = arr[:6]
+                present[i, j] = True
+
+    csi_frames_all = [frames[i] for i in np.flatnonzero(is_csi)]
     if not csi_frames_all:
         print("No CSI frames found.")
         return
 
-    # ---------------------------------------------------------
-    #   EXTRACT ALL MAC ADDRESSES
-    # ---------------------------------------------------------
-    all_macs = set()
-    for f in frames:
-        sh = f.get("StandardHeader") or f.get("standardHeader")
-        if not isinstance(sh, dict):
-            continue
-        for k in ("Addr1", "Addr2", "Addr3", "addr1", "addr2", "addr3"):
-            mac = norm_mac(mac_to_str(sh.get(k)))
-            if mac:
-                all_macs.add(mac)
+    all_macs = {m.decode() for m in np.unique(macs_to_str_array(hdrs[present]))}
 
     # ---------------------------------------------------------
     #   FILTER CSI BY TARGET TX
     # ---------------------------------------------------------
     TARGET = norm_mac(TARGET_TX_MAC)
     csi_frames = []
-    rx_list = []
+    rx_keys = np.empty(0, dtype=np.uint64)
 
     if TARGET in all_macs:
-        for f in csi_frames_all:
-            sh = f.get("StandardHeader") or f.get("standardHeader")
-            if not isinstance(sh, dict):
-                continue
-
-            tx = norm_mac(mac_to_str(sh.get("Addr2") or sh.get("addr2")))
-            rx = norm_mac(mac_to_str(sh.get("Addr1") or sh.get("addr1")))
-
-            if tx == TARGET:
-                csi_frames.append(f)
-                if is_valid_unicast(rx):
-                    rx_list.append(rx)
+        target = np.frombuffer(bytes.fromhex(TARGET.replace(":", "")), dtype=np.uint8)
+        mask, rx_keys = match_tx(hdrs, present, is_csi, target)
+        csi_frames = [frames[i] for i in np.flatnonzero(mask)]
 
         print("==========================================")
         print(" Target TX filtering ENABLED")
@@ -158,87 +208,115 @@ def analyze_csi(path):
     # ---------------------------------------------------------
     #   RX SELECTION (MOST CSI, UNICAST ONLY)
     # ---------------------------------------------------------
-    rx_counter = Counter(rx_list)
-    rx_primary = rx_counter.most_common(1)[0][0] if rx_counter else None
+    # Count packed keys with np.unique; order by count, ties by first
+    # appearance (Counter.most_common order), then format once per RX.
+    keys, first, counts = np.unique(rx_keys, return_index=True, return_counts=True)
+    order = np.lexsort((first, -counts))
+    rx_counts = [(u64_to_mac(k), int(c)) for k, c in zip(keys[order], counts[order])]
+    rx_primary = rx_counts[0][0] if rx_counts else None
 
     print(f"Total CSI frames used : {len(csi_frames)}")
     print("RX CSI counts (unicast only):")
-    for mac, cnt in rx_counter.most_common():
+    for mac, cnt in rx_counts:
         print(f"  {mac} : {cnt}")
     print(f"Primary RX : {rx_primary}\n")
 
     # ---------------------------------------------------------
     #   TIMESTAMPS
     # ---------------------------------------------------------
-    timestamps = []
+    # Filled in place and written by savetxt (one C format loop) instead of
+    # list appends and a Python write per line.
+    timestamps = np.empty(len(csi_frames), dtype=np.int64)
+    n_ts = 0
     for f in csi_frames:
-        ts = get_timestamp(f.get("RxSBasic") or f.get("rxSBasic"))
+        ts = get_timestamp(f.get(RXB_KEY))
         if ts is not None:
-            timestamps.append(ts)
+            timestamps[n_ts] = ts
+            n_ts += 1
 
-    with open(os.path.join(out_dir, "timestamps.txt"), "w") as f:
-        for t in timestamps:
-            f.write(f"{t}\n")
+    np.savetxt(os.path.join(out_dir, "timestamps.txt"), timestamps[:n_ts], fmt="%d")
 
     # ---------------------------------------------------------
     #   BUILD CSI MATRICES
     # ---------------------------------------------------------
-    Amp_list, Phase_list = [], []
+    # Frames are reduced as they stream by: only per-frame means, the first
+    # frame and a block-averaged heatmap (<= HEATMAP_MAX_ROWS rows) are
+    # kept, never the full N x K matrices. The first non-empty frame fixes K.
+    n_max = len(csi_frames)
+    block = -(-n_max // HEATMAP_MAX_ROWS)   # frames per heatmap row
+    amp_mean = np.empty(n_max, dtype=np.float32)
+    phase_mean = np.empty(n_max, dtype=np.float32)
+    amp0 = phase0 = None
+    K = None
+    n = 0
     csi_meta = None
 
     for f in csi_frames:
-        c = f.get("CSI")
-        if not isinstance(c, dict):
-            continue
-
+        c = f["CSI"]  # csi_frames only holds frames with a CSI dict
         if csi_meta is None:
             csi_meta = c
 
-        mag = np.array(c.get("Mag"))
-        ph = np.array(c.get("Phase"))
+        # float32 straight from the source lists: half the bytes of float64
+        # for every later pass, and ravel avoids flatten's extra copy.
+        mag = np.asarray(c.get("Mag"), dtype=np.float32).ravel()
+        ph = np.asarray(c.get("Phase"), dtype=np.float32).ravel()
 
         if mag.size == 0 or ph.size == 0:
             continue
 
-        mag = mag.flatten()
-        ph = ph.flatten()
+        if K is None:
+            K = mag.size
+            heat = np.zeros((-(-n_max // block), K), dtype=np.float32)
 
-        if Amp_list and mag.size != Amp_list[0].size:
+        if mag.size != K or ph.size != K:
             continue
 
-        Amp_list.append(mag)
-        Phase_list.append(ph)
+        if amp0 is None:
+            amp0, phase0 = mag, ph
+        amp_mean[n] = mag.mean()
+        phase_mean[n] = ph.mean()
+        heat[n // block] += mag
+        n += 1
 
-    if not Amp_list:
+    if n == 0:
         raise RuntimeError("No valid CSI matrices.")
 
-    Amp = np.vstack(Amp_list)
-    Phase = np.vstack(Phase_list)
+    amp_mean = amp_mean[:n]
+    phase_mean = phase_mean[:n]
+    rows = -(-n // block)
+    heat = heat[:rows]
+    heat /= np.minimum(n - np.arange(rows) * block, block)[:, None]  # last block may be short
 
     sub_idx = np.array(csi_meta.get("SubcarrierIndex") or []).flatten()
-    num_sub = sub_idx.size if sub_idx.size else Amp.shape[1]
+    num_sub = sub_idx.size if sub_idx.size else K
+
+    # Picoscenes parses the whole file into ps.raw up front (no per-frame
+    # access), so that list is the peak; drop it now that it is reduced
+    # rather than holding it through plotting.
+    del ps, frames, csi_frames_all, csi_frames, csi_meta
 
     # ---------------------------------------------------------
     #   PLOTS
     # ---------------------------------------------------------
     fig = plt.figure(figsize=(8, 4))
-    plt.plot(Amp[0]); plt.grid()
+    plt.plot(amp0); plt.grid()
     save_plot(fig, out_dir, "amp_frame1.png")
 
     fig = plt.figure(figsize=(8, 4))
-    plt.plot(Phase[0]); plt.grid()
+    plt.plot(phase0); plt.grid()
     save_plot(fig, out_dir, "phase_frame1.png")
 
     fig = plt.figure(figsize=(8, 4))
-    plt.plot(Amp.mean(axis=1)); plt.grid()
+    plt.plot(amp_mean); plt.grid()
     save_plot(fig, out_dir, "amplitude_over_time.png")
 
     fig = plt.figure(figsize=(8, 4))
-    plt.plot(Phase.mean(axis=1)); plt.grid()
+    plt.plot(phase_mean); plt.grid()
     save_plot(fig, out_dir, "phase_over_time.png")
 
+    # extent keeps the y axis in frame indices when rows are block-averaged
     fig = plt.figure(figsize=(8, 5))
-    plt.imshow(Amp, aspect="auto")
+    plt.imshow(heat, aspect="auto", extent=[-0.5, K - 0.5, n - 0.5, -0.5])
     plt.colorbar(label="Amplitude")
     save_plot(fig, out_dir, "amplitude_heatmap.png")
 
@@ -250,11 +328,11 @@ def analyze_csi(path):
         f.write(f"File            : {path}\n")
         f.write(f"TX MAC          : {TARGET}\n")
         f.write(f"Primary RX MAC  : {rx_primary}\n")
-        f.write(f"CSI Frames Used : {len(csi_frames)}\n")
+        f.write(f"CSI Frames Used : {n_max}\n")
         f.write(f"Subcarriers     : {num_sub}\n\n")
 
         f.write("RX CSI Counts (Unicast Only):\n")
-        for mac, cnt in rx_counter.most_common():
+        for mac, cnt in rx_counts:
             f.write(f"{mac} : {cnt}\n")
 
     print(f"[+] Saved CSI summary → {out_dir}/csi_summary.txt")
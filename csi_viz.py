@@ -22,9 +22,17 @@ Run:
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # plots are only saved to PNG; skip GUI backend setup
 import matplotlib.pyplot as plt
 
+try:
+    from numba import njit, prange  # optional: fused row mean/var kernel
+except ImportError:
+    njit = None
+
 import tkinter as tk
 from tkinter import filedialog, messagebox
 
@@ -50,34 +58,39 @@ def pick_file() -> str:
 
 
 # ---------------------------------------------------------------------
-#   TIMESTAMP HELPER (OPTIONAL, for future use)
+#   LOAD CSI → Amp, Phase (N x K)
 # ---------------------------------------------------------------------
-def get_timestamp(rx_basic):
-    """
-    Return one timestamp in microseconds from RxSBasic dict.
-    Tries several key spellings (Timestamp/SystemTime).
-    """
-    if not isinstance(rx_basic, dict):
-        return None
-
-    for key in ("Timestamp", "timestamp", "SystemTime", "systemTime"):
-        if key in rx_basic:
-            arr = np.array(rx_basic[key]).flatten()
-            if arr.size:
-                return int(arr[0])
-    return None
+def _frame_rows(c):
+    """Mag and Phase of one CSI block as flat float32 arrays."""
+    # float32 straight from the source lists: half the bytes of float64
+    # for every later pass, and ravel avoids flatten's extra copy.
+    mag = np.asarray(c.get("Mag"), dtype=np.float32).ravel()
+    ph = np.asarray(c.get("Phase"), dtype=np.float32).ravel()
+    return mag, ph
+
+
+def _fill_rows(csi_frames, lo, hi, K, Amp, Phase, ok):
+    """Worker: fill rows lo..hi-1 of Amp/Phase from csi_frames[lo:hi]."""
+    for i in range(lo, hi):
+        mag, ph = _frame_rows(csi_frames[i]["CSI"])
+        # Ensure consistent subcarrier count (mismatched frames are skipped)
+        if mag.size == K and ph.size == K:
+            Amp[i] = mag
+            Phase[i] = ph
+            ok[i] = True
 
 
-# ---------------------------------------------------------------------
-#   LOAD CSI → Amp, Phase (N x K)
-# ---------------------------------------------------------------------
 def load_csi(path):
     """
     Load a PicoScenes .csi file and build amplitude & phase matrices.
 
     Returns:
-        Amp   : ndarray, shape (N_frames, N_subcarriers)
-        Phase : ndarray, shape (N_frames, N_subcarriers)
+        Amp   : float32 ndarray, shape (N_frames, N_subcarriers)
+        Phase : float32 ndarray, shape (N_frames, N_subcarriers)
+
+    Picoscenes only offers the fully parsed frame list (ps.raw), so peak
+    memory is set by that list; it is released on return and only the two
+    matrices are kept.
     """
     ps = Picoscenes(path)
     frames = ps.raw
@@ -87,36 +100,40 @@ def load_csi(path):
     if not csi_frames:
         raise RuntimeError("No frames with 'CSI' field found in this file.")
 
-    Amp_list = []
-    Phase_list = []
-
-    for f in csi_frames:
-        c = f.get("CSI")
-        if not isinstance(c, dict):
-            continue
-
-        mag = np.array(c.get("Mag"))
-        ph = np.array(c.get("Phase"))
-
-        if mag.size == 0 or ph.size == 0:
-            continue
-
-        mag = mag.flatten()
-        ph = ph.flatten()
-
-        # Ensure consistent subcarrier count
-        if Amp_list and mag.size != Amp_list[0].size:
-            # Skip frames with mismatched size
-            continue
-
-        Amp_list.append(mag)
-        Phase_list.append(ph)
-
-    if not Amp_list:
+    # The first non-empty frame fixes K (found serially; frames before it
+    # are empty and would be skipped anyway).
+    K = None
+    for start, f in enumerate(csi_frames):
+        mag, ph = _frame_rows(f["CSI"])
+        if mag.size and ph.size:
+            K = mag.size
+            break
+    if K is None:
         raise RuntimeError("No valid CSI Mag/Phase arrays found in frames.")
+    csi_frames = csi_frames[start:]
+
+    # Row i belongs to frame i, so a thread pool can fill contiguous row
+    # ranges of the preallocated matrices in place, in any order; `ok`
+    # marks the accepted rows.
+    n = len(csi_frames)
+    Amp = np.empty((n, K), dtype=np.float32)
+    Phase = np.empty((n, K), dtype=np.float32)
+    ok = np.zeros(n, dtype=bool)
+
+    workers = min(os.cpu_count() or 1, max(1, n // 1024))
+    bounds = np.linspace(0, n, workers + 1).astype(int)
+    if workers == 1:
+        _fill_rows(csi_frames, 0, n, K, Amp, Phase, ok)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            jobs = [pool.submit(_fill_rows, csi_frames, lo, hi, K, Amp, Phase, ok)
+                    for lo, hi in zip(bounds[:-1], bounds[1:])]
+            for job in jobs:
+                job.result()
 
-    Amp = np.vstack(Amp_list)
-    Phase = np.vstack(Phase_list)
+    if not ok.all():
+        Amp = Amp[ok]
+        Phase = Phase[ok]
 
     return Amp, Phase
 
@@ -124,29 +141,101 @@ def load_csi(path):
 # ---------------------------------------------------------------------
 #   SAVE FIGURE UTILITY
 # ---------------------------------------------------------------------
-def save_fig(fig, out_dir, filename):
+def save_fig(fig, out_dir, filename, ax=None, cbar=None):
+    """
+    Save fig. With `ax` the figure is kept for reuse: `cbar` (if any) is
+    removed, handing its space back to ax, and ax is cleared.
+    """
     os.makedirs(out_dir, exist_ok=True)
     path = os.path.join(out_dir, filename)
-    fig.savefig(path, dpi=200, bbox_inches="tight")
-    plt.close(fig)
+    # tight_layout runs once; bbox_inches="tight" would render twice. Low
+    # zlib level: these PNGs are plots, encode time matters more than size.
+    fig.tight_layout()
+    fig.savefig(path, dpi=200, pil_kwargs={"compress_level": 1})
+    if ax is None:
+        plt.close(fig)
+    else:
+        if cbar is not None:
+            cbar.remove()
+        ax.clear()
     print(f"[+] Saved: {path}")
 
 
+def _figure(ax, size):
+    """(fig, ax) to draw on: the shared `ax` resized to `size`, or a new figure."""
+    if ax is None:
+        return plt.subplots(figsize=size)
+    ax.figure.set_size_inches(size)
+    return ax.figure, ax
+
+
 # ---------------------------------------------------------------------
 #   VISUALIZATIONS
 # ---------------------------------------------------------------------
-def plot_amplitude_heatmap(Amp, out_dir, base_name):
+HEATMAP_MAX_ROWS = 2048
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _row_mean_var_jit(A):
+        n, k = A.shape
+        mean = np.empty(n)
+        var = np.empty(n)
+        for i in prange(n):
+            s = 0.0
+            ss = 0.0
+            for j in range(k):
+                x = float(A[i, j])
+                s += x
+                ss += x * x
+            m = s / k
+            mean[i] = m
+            var[i] = max(ss / k - m * m, 0.0)
+        return mean, var
+
+
+def row_mean_var(A):
+    """
+    Per-frame mean and variance across subcarriers from one read of A
+    (sum and sum of squares, float64 accumulators). np.var would make a
+    mean pass plus a full N x K temporary of deviations.
+    """
+    if njit is not None:
+        return _row_mean_var_jit(np.ascontiguousarray(A))
+    mean = A.sum(axis=1, dtype=np.float64) / A.shape[1]
+    sq = np.einsum("ij,ij->i", A, A, dtype=np.float64) / A.shape[1]
+    return mean, np.maximum(sq - mean * mean, 0.0)
+
+
+def _block_mean_rows(A, target=HEATMAP_MAX_ROWS):
+    """
+    Average consecutive rows of A so at most ~`target` rows reach imshow
+    (the PNG cannot show more). Trailing rows that do not fill a whole
+    block are dropped. Returns (rows, frames_covered); rows is always
+    C-contiguous, so imshow never makes its own copy of a strided view.
+    """
+    f = max(1, A.shape[0] // target)
+    n = (A.shape[0] // f) * f
+    if f == 1:
+        return np.ascontiguousarray(A), n
+    return A[:n].reshape(n // f, f, A.shape[1]).mean(axis=1), n
+
+
+def plot_amplitude_heatmap(Amp, out_dir, base_name, ax=None):
     """
     Heatmap: Frame index vs Subcarrier index, color = amplitude.
     This is great for seeing gesture-induced distortions.
     """
     N, K = Amp.shape
-    fig, ax = plt.subplots(figsize=(10, 5))
+    rows, n = _block_mean_rows(Amp)
+    shared = ax  # None → own figure, closed after saving
+    fig, ax = _figure(ax, (10, 5))
     im = ax.imshow(
-        Amp,
+        rows,
         aspect="auto",
         origin="lower",
-        interpolation="nearest"
+        interpolation="nearest",
+        extent=(-0.5, K - 0.5, -0.5, n - 0.5)   # y axis stays in frame indices
     )
     ax.set_xlabel("Subcarrier Index")
     ax.set_ylabel("Frame Index")
@@ -155,21 +244,24 @@ def plot_amplitude_heatmap(Amp, out_dir, base_name):
     cbar.set_label("Amplitude")
 
     fname = f"{base_name}_AmplitudeHeatmap.png"
-    save_fig(fig, out_dir, fname)
+    save_fig(fig, out_dir, fname, ax=shared, cbar=cbar)
 
 
-def plot_phase_heatmap(Phase, out_dir, base_name):
+def plot_phase_heatmap(Phase, out_dir, base_name, ax=None):
     """
     Heatmap: Frame index vs Subcarrier index, color = phase.
     Phase is highly sensitive to motion; visual structure changes a lot.
     """
     N, K = Phase.shape
-    fig, ax = plt.subplots(figsize=(10, 5))
+    rows, n = _block_mean_rows(Phase)
+    shared = ax  # None → own figure, closed after saving
+    fig, ax = _figure(ax, (10, 5))
     im = ax.imshow(
-        Phase,
+        rows,
         aspect="auto",
         origin="lower",
-        interpolation="nearest"
+        interpolation="nearest",
+        extent=(-0.5, K - 0.5, -0.5, n - 0.5)   # y axis stays in frame indices
     )
     ax.set_xlabel("Subcarrier Index")
     ax.set_ylabel("Frame Index")
@@ -178,19 +270,20 @@ def plot_phase_heatmap(Phase, out_dir, base_name):
     cbar.set_label("Phase (rad)")
 
     fname = f"{base_name}_PhaseHeatmap.png"
-    save_fig(fig, out_dir, fname)
+    save_fig(fig, out_dir, fname, ax=shared, cbar=cbar)
 
 
-def plot_variance_over_time(Amp, out_dir, base_name):
+def plot_variance_over_time(Amp, out_dir, base_name, ax=None):
     """
     Short-term variance of amplitude over frames:
         Var(t) = variance across subcarriers at frame t
     Static environments → low, flat variance.
     Gesture motion     → clear spikes during movement.
     """
-    var_over_time = np.var(Amp, axis=1)
+    _, var_over_time = row_mean_var(Amp)
 
-    fig, ax = plt.subplots(figsize=(10, 4))
+    shared = ax  # None → own figure, closed after saving
+    fig, ax = _figure(ax, (10, 4))
     ax.plot(var_over_time)
     ax.set_xlabel("Frame Index")
     ax.set_ylabel("Variance (across subcarriers)")
@@ -198,10 +291,10 @@ def plot_variance_over_time(Amp, out_dir, base_name):
     ax.grid(True)
 
     fname = f"{base_name}_VariancePlot.png"
-    save_fig(fig, out_dir, fname)
+    save_fig(fig, out_dir, fname, ax=shared)
 
 
-def plot_pca_over_time(Amp, out_dir, base_name):
+def plot_pca_over_time(Amp, out_dir, base_name, ax=None):
     """
     PCA on CSI amplitude matrix (frames x subcarriers).
     We project onto the first principal component:
@@ -212,21 +305,30 @@ def plot_pca_over_time(Amp, out_dir, base_name):
     For static CSI → PC1 is nearly flat.
     For gesture CSI → clear oscillatory patterns.
     """
-    # Center the data along subcarrier axis
-    X = Amp - Amp.mean(axis=0, keepdims=True)
-
-    # SVD-based PCA (no sklearn dependency)
-    # X = U S V^T → first principal component direction is V[0]
-    U, S, Vt = np.linalg.svd(X, full_matrices=False)
+    # Center the data along subcarrier axis (float32, C-contiguous for BLAS)
+    X = np.ascontiguousarray(Amp - Amp.mean(axis=0, keepdims=True), dtype=np.float32)
+
+    # PCA without sklearn. Only PC1 is needed, so instead of the thin SVD
+    # of the whole N x K matrix, take the top eigenvector of the K x K
+    # scatter matrix X^T X (one BLAS product + a small eigh; exact, unlike
+    # a few rounds of power iteration). eigh sorts ascending → last column.
+    # Static capture (X numerically zero): PC1 is undefined and would only
+    # be rounding noise, so plot the flat line without the decomposition.
+    if np.linalg.norm(X) < 1e-6 * np.sqrt(X.size):
+        pc1_scores = np.zeros(X.shape[0], dtype=np.float32)
+    else:
+        _, V = np.linalg.eigh(X.T @ X)
+        v1 = V[:, -1]
 
-    # Scores along first PC:
-    pc1_scores = U[:, 0] * S[0]
+        # Scores along first PC (= U[:, 0] * S[0] of the SVD, up to sign):
+        pc1_scores = X @ v1
 
     # Normalize for nicer plotting
     if np.max(np.abs(pc1_scores)) > 0:
         pc1_scores = pc1_scores / np.max(np.abs(pc1_scores))
 
-    fig, ax = plt.subplots(figsize=(10, 4))
+    shared = ax  # None → own figure, closed after saving
+    fig, ax = _figure(ax, (10, 4))
     ax.plot(pc1_scores)
     ax.set_xlabel("Frame Index")
     ax.set_ylabel("PC1 (normalized)")
@@ -234,7 +336,7 @@ def plot_pca_over_time(Amp, out_dir, base_name):
     ax.grid(True)
 
     fname = f"{base_name}_PCAPlot.png"
-    save_fig(fig, out_dir, fname)
+    save_fig(fig, out_dir, fname, ax=shared)
 
 
 # ---------------------------------------------------------------------
@@ -250,11 +352,13 @@ def analyze_csi(path):
     Amp, Phase = load_csi(path)
     print(f"[i] CSI shape (Amp): {Amp.shape[0]} frames x {Amp.shape[1]} subcarriers")
 
-    # Generate the four visualizations
-    plot_amplitude_heatmap(Amp, out_dir, base_name)
-    plot_phase_heatmap(Phase, out_dir, base_name)
-    plot_variance_over_time(Amp, out_dir, base_name)
-    plot_pca_over_time(Amp, out_dir, base_name)
+    # Generate the four visualizations on one shared Figure/Axes
+    fig, ax = plt.subplots()
+    plot_amplitude_heatmap(Amp, out_dir, base_name, ax=ax)
+    plot_phase_heatmap(Phase, out_dir, base_name, ax=ax)
+    plot_variance_over_time(Amp, out_dir, base_name, ax=ax)
+    plot_pca_over_time(Amp, out_dir, base_name, ax=ax)
+    plt.close(fig)
 
     print("\n[✓] All visualizations generated.\n")
 
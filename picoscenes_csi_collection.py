@@ -10,12 +10,18 @@ Run:
 
 import os
 import sys
-import time
+import shlex
 import shutil
 import subprocess
 import tempfile
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from matlab import engine as matlab_engine  # optional: MATLAB Engine API
+except ImportError:
+    matlab_engine = None
 
 # ──────────────────────────────────────────────────────────────────────────────
 # FIXED CONFIGURATION (DO NOT EDIT)
@@ -57,8 +63,20 @@ def validate_environment():
     info("Validating system environment")
 
     required = ["PicoScenes", "iw", "rfkill", "nmcli", "array_prepare_for_picoscenes"]
+    # One scandir per PATH directory for all tools, instead of shutil.which
+    # probing every directory once per tool.
+    found = set()
+    for d in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        try:
+            with os.scandir(d or ".") as it:
+                for de in it:
+                    if (de.name in required and de.name not in found
+                            and de.is_file() and os.access(de.path, os.X_OK)):
+                        found.add(de.name)
+        except OSError:
+            continue
     for cmd in required:
-        if shutil.which(cmd) is None:
+        if cmd not in found:
             fatal(f"Required command not found: {cmd}")
 
     if os.geteuid() == 0:
@@ -135,10 +153,18 @@ def get_gui_config():
 # ──────────────────────────────────────────────────────────────────────────────
 # SYSTEM SETUP
 # ──────────────────────────────────────────────────────────────────────────────
+def shell_chain(*cmds):
+    """Shell line running cmds in order, stopping at the first failure."""
+    return " && ".join(shlex.join(c) for c in cmds)
+
 def prepare_psrd():
-    run(["mkdir", "-p", str(PSRD_DIR)], sudo=True)
-    run(["chmod", "777", str(PSRD_DIR)], sudo=True)
-    run(["chown", f"{os.getenv('USER')}:{os.getenv('USER')}", str(PSRD_DIR)], sudo=True)
+    # one `sudo sh -c` instead of a sudo auth + process launch per step
+    user = os.getenv("USER")
+    run(["sh", "-c", shell_chain(
+        ["mkdir", "-p", str(PSRD_DIR)],
+        ["chmod", "777", str(PSRD_DIR)],
+        ["chown", f"{user}:{user}", str(PSRD_DIR)],
+    )], sudo=True)
     ok("/mnt/psrd ready")
 
 def disable_wifi():
@@ -159,6 +185,28 @@ def prepare_array(center_freq, bandwidth):
     run(["iw", "dev"])
     ok("NIC prepared")
 
+def tune_logger(pid):
+    """
+    Optional scheduling for the PicoScenes logger, to cut packet loss from
+    scheduler jitter on its capture thread:
+      PICOSCENES_CPUS=2,3     pin it to those (ideally isolated) CPUs
+      PICOSCENES_RT_PRIO=50   SCHED_FIFO at that priority (via sudo chrt)
+    Both are off by default: pinning to busy CPUs or a real-time class can
+    starve the rest of the system (the --plot GUI included).
+    """
+    cpus = os.environ.get("PICOSCENES_CPUS")
+    if cpus:
+        try:
+            # Set right after spawn, so threads PicoScenes starts inherit it
+            os.sched_setaffinity(pid, {int(c) for c in cpus.split(",")})
+            info(f"PicoScenes pinned to CPUs {cpus}")
+        except (ValueError, OSError) as e:
+            info(f"Could not pin PicoScenes to CPUs {cpus}: {e}")
+
+    prio = os.environ.get("PICOSCENES_RT_PRIO")
+    if prio:
+        run(["chrt", "-a", "-f", "-p", prio, str(pid)], sudo=True, check=False)
+
 def collect_csi(duration):
     info(f"Collecting CSI for {duration} seconds")
 
@@ -169,11 +217,14 @@ def collect_csi(duration):
         "--mode", "logger",
         "--plot"
     ])
+    tune_logger(proc.pid)
 
-    start = time.time()
+    # Block in wait() instead of polling: returns at once if PicoScenes
+    # exits early, otherwise times out after `duration`.
     try:
-        while time.time() - start < duration:
-            time.sleep(1)
+        proc.wait(timeout=duration)
+    except subprocess.TimeoutExpired:
+        pass
     finally:
         proc.terminate()
         try:
@@ -187,23 +238,33 @@ def collect_csi(duration):
 # RESTORE NETWORK
 # ──────────────────────────────────────────────────────────────────────────────
 def restore_wifi():
-    run(["iw", "dev", MON_IFACE, "del"], sudo=True, check=False)
-    run(["nmcli", "radio", "wifi", "on"], sudo=True)
-    run(["systemctl", "restart", "NetworkManager"], sudo=True)
-    run(["ip", "link", "set", WIFI_IFACE, "up"], sudo=True)
+    # mon iface may already be gone: its removal may fail (`;`), as before
+    run(["sh", "-c", shlex.join(["iw", "dev", MON_IFACE, "del"]) + "; " + shell_chain(
+        ["nmcli", "radio", "wifi", "on"],
+        ["systemctl", "restart", "NetworkManager"],
+        ["ip", "link", "set", WIFI_IFACE, "up"],
+    )], sudo=True)
     ok("Wi-Fi restored")
 
 # ──────────────────────────────────────────────────────────────────────────────
 # CSI DISCOVERY + VALIDATION
 # ──────────────────────────────────────────────────────────────────────────────
 def find_csi_file():
-    files = sorted(Path.cwd().glob("rx_*.csi"), key=lambda p: p.stat().st_mtime)
-    if not files:
+    # Newest rx_*.csi in one scandir pass: a plain prefix/suffix test per
+    # name, no Path per entry, and DirEntry caches the stat it makes.
+    best, best_t = None, -1.0
+    with os.scandir(Path.cwd()) as it:
+        for de in it:
+            name = de.name
+            if name.startswith("rx_") and name.endswith(".csi"):
+                t = de.stat().st_mtime
+                if t > best_t:
+                    best, best_t = de.path, t
+    if best is None:
         fatal("No .csi file found")
-    return files[-1]
+    return Path(best)
 
-def python_validate(csi):
-    st = csi.stat()
+def python_validate(csi, st):
     report = csi.with_suffix(".python_validation.txt")
     report.write_text(
         f"File: {csi}\n"
@@ -212,12 +273,58 @@ def python_validate(csi):
     )
     ok("Python validation complete")
 
+def shared_matlab():
+    """
+    Connect to an already running shared MATLAB session (one started with
+    matlab.engine.shareEngine), so validation skips MATLAB's cold start.
+    None when the Engine API or a shared session is not available.
+    """
+    if matlab_engine is None:
+        return None
+    try:
+        names = matlab_engine.find_matlab()
+        return matlab_engine.connect_matlab(names[0]) if names else None
+    except Exception:
+        return None
+
+MATLAB_FRAME_STATS = """
+function [n, sz] = csi_frame_stats(path)
+    [b, ~] = parseCSIFile(path);
+    n = numel(b.Frames);
+    sz = size(b.Frames(1).CSI);
+end
+"""
+
 def matlab_validate(csi):
+    report = csi.with_suffix(".matlab_validation.txt")
+
+    eng = shared_matlab()
+    if eng is not None:
+        # Parse inside MATLAB and bring back only scalars: b.Frames is a
+        # struct array the engine cannot return, and copying every frame's
+        # CSI across would cost more than the cold start. The helper is a
+        # function, so its variables never reach the shared workspace.
+        info("Validating in shared MATLAB session")
+        with tempfile.TemporaryDirectory() as td:
+            (Path(td) / "csi_frame_stats.m").write_text(MATLAB_FRAME_STATS)
+            try:
+                eng.addpath(td, nargout=0)
+                try:
+                    n, sz = eng.csi_frame_stats(str(csi), nargout=2)
+                finally:
+                    eng.rmpath(td, nargout=0)
+                size = " ".join(str(int(d)) for d in sz[0])
+                lines = [f"Frames: {int(n)}", f"CSI size: [{size}]", "PASS"]
+            except Exception as e:
+                lines = ["FAIL", str(e)]
+        report.write_text("\n".join(lines) + "\n")
+        ok("MATLAB validation complete")
+        return
+
     matlab = shutil.which("matlab")
     if not matlab:
         fatal("MATLAB not found")
 
-    report = csi.with_suffix(".matlab_validation.txt")
     code = f"""
     fid=fopen('{report}','w');
     try
@@ -230,7 +337,6 @@ def matlab_validate(csi):
     end
     fclose(fid);
     """
-
     with tempfile.TemporaryDirectory() as td:
         m = Path(td) / "v.m"
         m.write_text(code)
@@ -253,10 +359,18 @@ def main():
     restore_wifi()
 
     csi = find_csi_file()
-    run(["ls", "-lh", str(csi)])
-
-    python_validate(csi)
-    matlab_validate(csi)
+    st = csi.stat()   # shared with python_validate; no `ls -lh` fork
+    print(f"{csi}  {st.st_size / 1e6:.1f} MB  {datetime.fromtimestamp(st.st_mtime)}")
+    # A near-empty capture would fail anyway; stop before MATLAB starts up
+    if st.st_size < MIN_CSI_SIZE_BYTES:
+        fatal(f"CSI file too small ({st.st_size} bytes < {MIN_CSI_SIZE_BYTES}): {csi}")
+
+    # Independent checks: overlap MATLAB's slow -batch start-up with the
+    # Python one. result() re-raises either side's failure (fatal → exit).
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        jobs = [ex.submit(python_validate, csi, st), ex.submit(matlab_validate, csi)]
+        for job in jobs:
+            job.result()
 
     ok("Pipeline completed successfully")
 
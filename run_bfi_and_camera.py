@@ -2,6 +2,9 @@
 import os
 import sys
 import time
+import ctypes
+import ctypes.util
+import select
 import signal
 import subprocess
 from pathlib import Path
@@ -28,6 +31,15 @@ BFI_STOP_PATTERNS = [
     r"No capture file\.",   # bfi_capture.py exits with this message
 ]
 
+
+def _compiled(patterns):
+    """One alternation, so each log line costs a single search()."""
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+
+BFI_START_RE = _compiled(BFI_START_PATTERNS)
+BFI_STOP_RE = _compiled(BFI_STOP_PATTERNS)
+
 WAIT_BFI_START_TIMEOUT_S = 600
 CAMERA_GRACEFUL_TIMEOUT_S = 180
 
@@ -51,18 +63,45 @@ def start_process(cmd, log_path: Path, env: dict | None = None):
     """
     Start child process in its own process group; redirect stdout+stderr to log_path.
     """
-    log_f = open(log_path, "w", buffering=1)
+    # Only the child writes here (through its own dup of the fd), so no
+    # Python-side line buffering; O_CLOEXEC keeps the fd out of other children.
+    fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+    log_f = os.fdopen(fd, "w")
     p = subprocess.Popen(
         cmd,
         stdout=log_f,
         stderr=subprocess.STDOUT,
         text=True,
-        preexec_fn=os.setsid,
+        start_new_session=True,   # setsid without preexec_fn: keeps the posix_spawn/vfork path
         env=env,
     )
     return p, log_f
 
 
+def wait_exit(p: subprocess.Popen, timeout: float) -> bool:
+    """
+    Wait up to `timeout` s for p to exit; True if it did. Blocks on a pidfd
+    (Linux 5.3+) so the exit wakes us at once; elsewhere polls every 0.1 s.
+    """
+    try:
+        fd = os.pidfd_open(p.pid)
+    except (AttributeError, OSError):
+        fd = None
+    if fd is not None:
+        try:
+            select.select([fd], [], [], timeout)
+        finally:
+            os.close(fd)
+        return p.poll() is not None
+
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if p.poll() is not None:
+            return True
+        time.sleep(0.1)
+    return p.poll() is not None
+
+
 def terminate_process_group(p: subprocess.Popen | None, name: str, timeout: float = 8.0):
     """
     Hard stop fallback: SIGTERM then SIGKILL.
@@ -71,11 +110,8 @@ def terminate_process_group(p: subprocess.Popen | None, name: str, timeout: floa
         return
     try:
         os.killpg(p.pid, signal.SIGTERM)
-        t0 = time.time()
-        while time.time() - t0 < timeout:
-            if p.poll() is not None:
-                return
-            time.sleep(0.1)
+        if wait_exit(p, timeout):
+            return
         os.killpg(p.pid, signal.SIGKILL)
     except ProcessLookupError:
         return
@@ -99,11 +135,8 @@ def interrupt_then_wait(p: subprocess.Popen | None, name: str, timeout: float):
         terminate_process_group(p, name)
         return
 
-    t0 = time.time()
-    while time.time() - t0 < timeout:
-        if p.poll() is not None:
-            return
-        time.sleep(0.1)
+    if wait_exit(p, timeout):
+        return
 
     print(f"[WARN] {name} did not exit after SIGINT; forcing termination...")
     terminate_process_group(p, name)
@@ -119,18 +152,44 @@ def print_save_locations():
     print("[END SAVE LOCATIONS]\n")
 
 
-def _compiled(patterns):
-    return [re.compile(p) for p in patterns]
+# inotify (Linux) lets the log tail block until the file is written instead
+# of waking every 50 ms; without it the tail falls back to sleep-polling.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
 
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _libc.inotify_init1
+except (OSError, AttributeError):
+    _libc = None
 
-def wait_for_log_pattern(log_path: Path, patterns, timeout_s: float | None):
+
+def _inotify_watch(path: Path):
+    """
+    Non-blocking inotify fd watching path for writes, or None if unavailable.
+    """
+    if _libc is None:
+        return None
+    fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        return None
+    if _libc.inotify_add_watch(fd, os.fsencode(path), IN_MODIFY | IN_CLOSE_WRITE) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def wait_for_log_pattern(log_path: Path, rgx: re.Pattern, timeout_s: float | None,
+                         from_end: bool = False):
     """
     Robust log watcher:
-      - scans existing content from the beginning
+      - scans existing content from the beginning (from_end=False)
       - then tails for new lines
+    from_end=True skips what is already in the log; only safe when the
+    marker cannot have been written yet (e.g. the START marker, which
+    waits for a click in the BFI GUI).
     Returns the matching line (str) or None on timeout.
     """
-    compiled = _compiled(patterns)
     start_t = time.time()
 
     # Wait for the file to exist
@@ -139,26 +198,50 @@ def wait_for_log_pattern(log_path: Path, patterns, timeout_s: float | None):
             return None
         time.sleep(0.05)
 
-    with open(log_path, "r", errors="replace") as f:
-        # 1) Scan existing content immediately (prevents race)
-        existing = f.read()
-        for line in existing.splitlines():
-            for rgx in compiled:
-                if rgx.search(line):
-                    return line.strip()
-
-        # 2) Tail for new lines
+    # Watch before the first read so no write between read and wait is missed
+    ino = _inotify_watch(log_path)
+    fd = os.open(log_path, os.O_RDONLY)
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)   # read front to back
+    if from_end:
+        os.lseek(fd, 0, os.SEEK_END)
+    buf = bytearray()
+    try:
+        # Existing content and the tail go through the same loop: read in
+        # 64 KiB chunks, decode only complete lines, and run one regex
+        # search over the whole block instead of a readline() per line.
         while True:
-            line = f.readline()
-            if not line:
-                if timeout_s is not None and time.time() - start_t > timeout_s:
-                    return None
-                time.sleep(0.05)
+            chunk = os.read(fd, 65536)
+            if chunk:
+                buf += chunk
+                cut = buf.rfind(b"\n") + 1
+                if not cut:
+                    continue
+                text = buf[:cut].decode(errors="replace")
+                del buf[:cut]
+                m = rgx.search(text)
+                if m:
+                    lo = text.rfind("\n", 0, m.start()) + 1
+                    hi = text.find("\n", m.start())
+                    return text[lo:hi].strip()
                 continue
 
-            for rgx in compiled:
-                if rgx.search(line):
-                    return line.strip()
+            elapsed = time.time() - start_t
+            if timeout_s is not None and elapsed > timeout_s:
+                return None
+            if ino is None:
+                time.sleep(0.05)
+                continue
+            remaining = None if timeout_s is None else timeout_s - elapsed
+            if select.select([ino], [], [], remaining)[0]:
+                try:
+                    os.read(ino, 4096)   # drain; contents not needed
+                except BlockingIOError:
+                    pass
+    finally:
+        os.close(fd)
+        if ino is not None:
+            os.close(ino)
 
 
 def main():
@@ -180,33 +263,41 @@ def main():
     bfi_f = cam_f = None
 
     # Unbuffered output is important because stdout is redirected to a file.
-    base_env = os.environ.copy()
-    base_env["PYTHONUNBUFFERED"] = "1"
+    # Set in our own environment and let children inherit it (env=None):
+    # no per-child environment dict to copy and serialize.
+    os.environ["PYTHONUNBUFFERED"] = "1"
 
     try:
         # 1) Start BFI first (GUI opens)
         bfi_cmd = [sys.executable, str(BFI_SCRIPT)]
-        bfi_p, bfi_f = start_process(bfi_cmd, bfi_log, env=base_env)
+        bfi_p, bfi_f = start_process(bfi_cmd, bfi_log)
         print(f"[INFO] BFI started (pid={bfi_p.pid})")
         print("[INFO] Waiting for BFI capture to START (click Start Capture in the GUI)...")
 
-        start_line = wait_for_log_pattern(bfi_log, BFI_START_PATTERNS, timeout_s=WAIT_BFI_START_TIMEOUT_S)
+        start_line = wait_for_log_pattern(bfi_log, BFI_START_RE, timeout_s=WAIT_BFI_START_TIMEOUT_S,
+                                          from_end=True)
         if start_line is None:
             print("[ERROR] Timed out waiting for BFI capture to start. Stopping BFI.")
             return
         print(f"[INFO] Detected BFI capture start: {start_line}")
 
         # 2) Start camera ONLY after BFI capture has truly started
-        cam_env = base_env.copy()
         # Optional: run effectively "until stopped by SIGINT" from the launcher
-        cam_env["CAM_DURATION"] = "999999"
+        prev_duration = os.environ.get("CAM_DURATION")
+        os.environ["CAM_DURATION"] = "999999"
         cam_cmd = [sys.executable, str(CAM_SCRIPT)]
-        cam_p, cam_f = start_process(cam_cmd, cam_log, env=cam_env)
+        try:
+            cam_p, cam_f = start_process(cam_cmd, cam_log)
+        finally:
+            if prev_duration is None:
+                del os.environ["CAM_DURATION"]
+            else:
+                os.environ["CAM_DURATION"] = prev_duration
         print(f"[INFO] Camera started (pid={cam_p.pid})")
 
         # 3) Wait for BFI to stop/save
         print("[INFO] Waiting for BFI capture to STOP...")
-        stop_line = wait_for_log_pattern(bfi_log, BFI_STOP_PATTERNS, timeout_s=None)
+        stop_line = wait_for_log_pattern(bfi_log, BFI_STOP_RE, timeout_s=None)
         print(f"[INFO] Detected BFI capture stop: {stop_line}")
 
         # 4) Gracefully stop camera (prevents MP4 corruption)
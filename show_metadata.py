@@ -38,36 +38,38 @@ def sci(x):
 
 
 def shape_desc(arr):
-    arr = np.array(arr)
+    arr = np.asarray(arr)
     dims = " x ".join(str(d) for d in arr.shape)
     if np.iscomplexobj(arr):
         return f"({dims}) complex double"
     return f"({dims}) double"
 
 
-def compute_phase_regression(Phase, sc_idx, num_rx):
+def compute_phase_regression(Y, sc_idx):
     """
     MATLAB-style PhaseSlope and PhaseIntercept computation:
-    For each RX antenna, fit:
+    For each RX antenna (column r of Y, shape num_tones x num_rx), fit:
          phase = slope * sc_index + intercept
+    A two-parameter line fit has a closed form, so every antenna is solved
+    at once without lstsq:
+         slope = cov(x, y) / var(x),  intercept = mean(y) - slope * mean(x)
+    Returns (num_rx, 2) rows of [slope, intercept].
     """
-    Phase = np.array(Phase)
-    sc_idx = np.array(sc_idx)
-    result = []
-
-    for r in range(num_rx):
-        y = Phase[:, r, 0]     # phase for RX r
-        x = sc_idx.astype(float)
-
-        # least squares: slope, intercept
-        A = np.vstack([x, np.ones_like(x)]).T
-        slope, intercept = np.linalg.lstsq(A, y, rcond=None)[0]
-        result.append([slope, intercept])
-
-    return np.array(result)
+    x = np.asarray(sc_idx, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    xm = x.mean()
+    xc = x - xm
+    ym = Y.mean(axis=0)
+    slopes = (xc @ (Y - ym)) / (xc @ xc)
+    intercepts = ym - slopes * xm
+    return np.stack([slopes, intercepts], axis=1)
 
 
 def show_metadata(path):
+    # Picoscenes parses the whole file up front and only exposes the full
+    # frame list (no iterator or frame-count limit), so the first-frame
+    # shortcut below saves the scan, not the parse. Truly early-out reads
+    # would need a hand-written .csi frame walker feeding Picoscenes.
     ps = Picoscenes(path)
     frames = ps.raw
 
@@ -118,10 +120,11 @@ def show_metadata(path):
         print_kv(key, val)
 
     # ---------- Build CSI matrices ----------
-    CSI = np.array(csi["CSI"])
-    Mag = np.array(csi["Mag"])
-    Phase = np.array(csi["Phase"])
-    sc_idx = np.array(csi["SubcarrierIndex"])
+    # asarray/reshape: views of the arrays Picoscenes already returned
+    CSI = np.asarray(csi["CSI"])
+    Mag = np.asarray(csi["Mag"])
+    Phase = np.asarray(csi["Phase"])
+    sc_idx = np.asarray(csi["SubcarrierIndex"])
 
     num_tones = int(csi["numTones"])
     num_rx = int(csi["numRx"])
@@ -138,7 +141,7 @@ def show_metadata(path):
     print_kv("SubcarrierIndex", f"(1 x {sc_idx.size}) double")
 
     # ---------- Compute MATLAB-style PhaseSlope & PhaseIntercept ----------
-    PhaseSlopeIntercept = compute_phase_regression(Phase, sc_idx, num_rx)
+    PhaseSlopeIntercept = compute_phase_regression(Phase[:, :, 0], sc_idx)
 
     print_kv("PhaseSlope", str(PhaseSlopeIntercept[:,0])[:80] + "...")
     print_kv("PhaseIntercept", str(PhaseSlopeIntercept[:,1])[:80] + "...")